@@ -0,0 +1,629 @@
+"""
+micro benchmarks for the tokens module
+
+    python bench.py             # run all benchmarks
+    python bench.py layout      # run only the named benchmark(s)
+
+(c) Stefan LOESCH, topaze.blue 2020.
+
+Licensed under the MIT license https://opensource.org/licenses/MIT
+"""
+import sys
+import timeit
+import tracemalloc
+from collections import OrderedDict
+
+from tokens import Token, FrozenTokenSet, TokenMap
+
+N = 100000
+
+def _timeit(stmt, number=N, repeat=5, **ns):
+    "best time per call of stmt, in ns"
+    t = min(timeit.repeat(stmt, globals=ns, number=number, repeat=repeat))
+    return t / number * 1e9
+
+def _memory(factory, number=10000):
+    "allocated bytes per object created by factory(i), as seen by tracemalloc"
+    keep = []
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(number):
+        keep.append(factory(i))
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / number
+
+def _report(label, value, unit):
+    print("  {:<44} {:>12.1f} {}".format(label, value, unit))
+
+
+class _LegacyToken:
+    "the pre-slots layout of Token (instance __dict__ plus a separate TokenValue object)"
+
+    class TokenValue:
+        def __init__(s, strval=None, intval=None, floatval=None, dictval=None, listval=None):
+            s.strval = strval
+            s.intval = intval
+            s.floatval = floatval
+            s.dictval = dictval
+            s.listval = listval
+
+    _register = OrderedDict()
+    _index = OrderedDict()
+    def __init__(s, strval=None, intval=None, floatval=None, dictval=None, listval=None):
+        s._val = s.TokenValue(strval, intval, floatval, dictval, listval)
+        s._register.setdefault(s.__class__, OrderedDict())[s.str] = s
+        s._index[s.str] = s
+
+    @property
+    def int(s):
+        return s._val.intval
+
+    @property
+    def str(s):
+        return s._val.strval
+
+def bench_layout():
+    "per token memory and per access latency, legacy layout vs slotted layout"
+    class LayoutToken(Token): pass
+    LayoutToken.makeroot()
+    class SlottedToken(Token):
+        __slots__ = ()
+    SlottedToken.makeroot()
+    legacy = _LegacyToken("LEGACY", 1)
+    token = SlottedToken("SLOTTED", 1)
+
+    # includes the registration cost (the legacy class registers in the same way)
+    _report("memory per token (legacy)", _memory(lambda i: _LegacyToken("L%d" % i, i)), "bytes")
+    _report("memory per token (slotted, no __slots__)", _memory(lambda i: LayoutToken("S%d" % i, i)), "bytes")
+    _report("memory per token (slotted, __slots__ = ())", _memory(lambda i: SlottedToken("S%d" % i, i)), "bytes")
+
+    _report(".str access (legacy)", _timeit("t.str", t=legacy), "ns")
+    _report(".str access (slotted)", _timeit("t.str", t=token), "ns")
+    _report(".int access (legacy)", _timeit("t.int", t=legacy), "ns")
+    _report(".int access (slotted)", _timeit("t.int", t=token), "ns")
+    _report("isinstance(t, C) (legacy)", _timeit("isinstance(t, C)", t=legacy, C=_LegacyToken), "ns")
+    _report("isinstance(t, C) (slotted)", _timeit("isinstance(t, C)", t=token, C=SlottedToken), "ns")
+    _report("t.isof(C) (slotted)", _timeit("t.isof(C)", t=token, C=SlottedToken), "ns")
+
+def bench_hash():
+    "token as dict key vs int as dict key"
+    class HashToken(Token): pass
+    HashToken.makeroot()
+    tokens = [HashToken("H%d" % i, i) for i in range(100)]
+    bytoken = {t: t.int for t in tokens}
+    byint = {t.int: t.int for t in tokens}
+    _report("dict lookup (int key)", _timeit("d[k]", d=byint, k=50), "ns")
+    _report("dict lookup (token key)", _timeit("d[k]", d=bytoken, k=tokens[50]), "ns")
+    _report("token == token (same)", _timeit("k == k", k=tokens[50]), "ns")
+
+def bench_listings():
+    "tokens() and subclasses() on a hierarchy of 1000 classes with 10 tokens each"
+    class ListToken(Token): pass
+    ListToken.makeroot()
+    classes = [type("ListClass%d" % i, (ListToken,), {}) for i in range(1000)]
+    for i, c in enumerate(classes):
+        for j in range(10):
+            c("L%d_%d" % (i, j))
+    scan = "tuple(t._str for c in R._register if issubclass(c, R) for t in R._register[c].values())"
+    _report("tokens() by scanning the register", _timeit(scan, number=10, R=ListToken) / 1000, "us")
+    _report("tokens() (cached)", _timeit("R.tokens()", R=ListToken) / 1000, "us")
+    _report("tokens(offset=5000, limit=10)", _timeit("R.tokens(offset=5000, limit=10)", R=ListToken) / 1000, "us")
+    _report("subclasses() (cached)", _timeit("R.subclasses()", R=ListToken) / 1000, "us")
+
+def bench_hierarchy():
+    "ancestry queries on a synthetic hierarchy (chain of depth 50, then a tree 4 levels deep and 10 wide)"
+    class TreeToken(Token):
+        @classmethod
+        def issubtoken_mro(cls, other):
+            "issubtoken as implemented before the class hierarchy index (the baseline)"
+            return issubclass(other, cls)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    chain = [TreeToken]
+    for i in range(50):
+        chain.append(type("Chain%d" % i, (chain[-1],), {}))
+    level = [chain[-1]]
+    for i in range(4):
+        level = [type("Wide%d_%d" % (i, j), (parent,), {}) for parent in level for j in range(10)]
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    leaf, top, other = level[-1], chain[1], level[0]
+    nclasses = len(TreeToken.allsubclasses())
+    _report("classes in the hierarchy", nclasses, "")
+    _report("memory per class (including the index)", memory / nclasses, "bytes")
+    _report("top.issubtoken_mro(leaf) (hit, baseline)", _timeit("top.issubtoken_mro(leaf)", leaf=leaf, top=top), "ns")
+    _report("other.issubtoken_mro(leaf) (miss, baseline)", _timeit("other.issubtoken_mro(leaf)", leaf=leaf, other=other), "ns")
+    _report("top.issubtoken(leaf) (hit)", _timeit("top.issubtoken(leaf)", leaf=leaf, top=top), "ns")
+    _report("other.issubtoken(leaf) (miss)", _timeit("other.issubtoken(leaf)", leaf=leaf, other=other), "ns")
+    _report("leaf.isparenttoken(top)", _timeit("leaf.isparenttoken(top)", leaf=leaf, top=top), "ns")
+    _report("leaf.depth()", _timeit("leaf.depth()", leaf=leaf), "ns")
+    _report("TreeToken.allsubclasses(namesOnly=False)", 
+                _timeit("R.allsubclasses(namesOnly=False)", number=100, R=TreeToken) / 1000, "us")
+
+def bench_tokenset():
+    "FrozenTokenSet vs tuple and frozenset membership and set operations (root with 1000 tokens)"
+    class SetToken(Token): pass
+    SetToken.makeroot()
+    class Paused(SetToken): pass
+    tokens = [SetToken("T%d" % i) for i in range(997)] + [Paused("P%d" % i) for i in range(3)]
+    stopped = tuple(Paused.tokens(strOnly=False))
+    ns = dict(t=tokens[-1], tup=stopped, fs=frozenset(stopped), ts=FrozenTokenSet(stopped),
+                fa=frozenset(tokens[:500]), fb=frozenset(tokens[250:]),
+                ta=FrozenTokenSet(tokens[:500]), tb=FrozenTokenSet(tokens[250:]), P=Paused)
+    _report("t in tuple (3 tokens)", _timeit("t in tup", **ns), "ns")
+    _report("t in frozenset (3 tokens)", _timeit("t in fs", **ns), "ns")
+    _report("t in FrozenTokenSet (3 tokens)", _timeit("t in ts", **ns), "ns")
+    _report("t in FrozenTokenSet (ordinal 0)", _timeit("t in ts", **dict(ns, t=tokens[0], ts=ns["ta"])), "ns")
+    class BigSetToken(Token): pass
+    BigSetToken.makeroot()
+    big = BigSetToken.bulkdefine([BigSetToken], [(0, "B%d" % i) for i in range(1000000)])
+    ns.update(big=FrozenTokenSet(big[::2]), bigfs=frozenset(big[::2]), lo=big[0], mid=big[500000])
+    _report("t in frozenset (ordinal 0, 1M tokens)", _timeit("lo in bigfs", **ns), "ns")
+    _report("t in FrozenTokenSet (ordinal 0, 1M tokens)", _timeit("lo in big", **ns), "ns")
+    _report("t in FrozenTokenSet (ordinal 500000, 1M)", _timeit("mid in big", **ns), "ns")
+    _report("frozenset union (500 | 750 tokens)", _timeit("fa | fb", number=1000, **ns), "ns")
+    _report("FrozenTokenSet union (500 | 750 tokens)", _timeit("ta | tb", **ns), "ns")
+    _report("frozenset intersection", _timeit("fa & fb", number=1000, **ns), "ns")
+    _report("FrozenTokenSet intersection", _timeit("ta & tb", **ns), "ns")
+    _report("FrozenTokenSet.of(Paused) (cached mask)", _timeit("FrozenTokenSet.of(P)", FrozenTokenSet=FrozenTokenSet, **ns), "ns")
+
+def bench_tokenmap():
+    "TokenMap vs dict keyed by tokens (root with 1000 tokens, all mapped)"
+    class MapToken(Token): pass
+    MapToken.makeroot()
+    tokens = [MapToken("M%d" % i) for i in range(1000)]
+    ns = dict(t=tokens[500], d=dict.fromkeys(tokens, 0), m=TokenMap.fromclass(MapToken, 0), 
+                R=MapToken, TokenMap=TokenMap)
+    _report("dict memory", sys.getsizeof(ns["d"]), "bytes")
+    _report("TokenMap memory", sys.getsizeof(ns["m"]) + sys.getsizeof(ns["m"]._values), "bytes")
+    _report("dict[t]", _timeit("d[t]", **ns), "ns")
+    _report("TokenMap[t]", _timeit("m[t]", **ns), "ns")
+    _report("dict.get(t)", _timeit("d.get(t)", **ns), "ns")
+    _report("TokenMap.get(t)", _timeit("m.get(t)", **ns), "ns")
+    _report("dict[t] = 1", _timeit("d[t] = 1", **ns), "ns")
+    _report("TokenMap[t] = 1", _timeit("m[t] = 1", **ns), "ns")
+    _report("dict.items() iteration", _timeit("for k, v in d.items(): pass", number=1000, **ns) / 1000, "us")
+    _report("TokenMap.items() iteration", _timeit("for k, v in m.items(): pass", number=1000, **ns) / 1000, "us")
+    _report("dict.fromkeys(R.tokens(False), 0)", 
+                _timeit("dict.fromkeys(R.tokens(False), 0)", number=1000, **ns) / 1000, "us")
+    _report("TokenMap.fromclass(R, 0)", _timeit("TokenMap.fromclass(R, 0)", number=1000, **ns) / 1000, "us")
+
+def bench_freeze():
+    "lookups before and after Root.freeze() (root with 10000 tokens in 100 classes)"
+    class FreezeToken(Token): pass
+    FreezeToken.makeroot(globalNumIndex=True)
+    classes = [type("FreezeClass%d" % i, (FreezeToken,), {}) for i in range(100)]
+    for i in range(10000):
+        classes[i % 100]("F%d" % i, i)
+    ns = dict(R=FreezeToken, C=classes[50])
+    for label in ("mutable", "frozen"):
+        _report("byval ({})".format(label), _timeit("R.byval('F5000')", **ns), "ns")
+        _report("bynum ({})".format(label), _timeit("R.bynum(5000)", **ns), "ns")
+        _report("tokens() ({})".format(label), _timeit("C.tokens()", **ns), "ns")
+        FreezeToken.freeze()
+
+def bench_batch():
+    "byvals/bynums vs byval/bynum in a loop (batch of 100000 values, 10% misses, root with 10000 tokens)"
+    class BatchToken(Token): pass
+    BatchToken.makeroot(globalNumIndex=True)
+    for i in range(10000):
+        BatchToken("B%d" % i, i)
+    nums = [i % 11000 for i in range(0, 100000 * 7, 7)]
+    ns = dict(R=BatchToken, vals=["B%d" % i for i in nums], nums=nums)
+    loop = "[R.byval(v, noneIfMissing=True) for v in vals]"
+    _report("byval loop (per element)", _timeit(loop, number=10, **ns) / 100000, "ns")
+    _report("byvals (per element)", _timeit("R.byvals(vals)", number=10, **ns) / 100000, "ns")
+    _report("byvals returnMisses (per element)", _timeit("R.byvals(vals, returnMisses=True)", number=10, **ns) / 100000, "ns")
+    loop = "[R.bynum(v, noneIfMissing=True) for v in nums]"
+    _report("bynum loop (per element)", _timeit(loop, number=10, **ns) / 100000, "ns")
+    _report("bynums (per element)", _timeit("R.bynums(nums)", number=10, **ns) / 100000, "ns")
+
+def bench_bytes():
+    "bytes lookups: decode + byval vs bybytes on slices of a received buffer, with and without bytes index"
+    for bytesIndex in (False, True):
+        class BytesToken(Token): pass
+        BytesToken.makeroot(bytesIndex=bytesIndex)
+        label = "bytes index" if bytesIndex else "no bytes index"
+        _report("memory per token ({})".format(label), _memory(lambda i: BytesToken("EVENT_%d" % i)), "bytes")
+        buffer = b"....EVENT_5000...."
+        ns = dict(R=BytesToken, b=buffer[4:14], mv=memoryview(buffer)[4:14], ba=bytearray(buffer)[4:14], 
+                    t=BytesToken.byval("EVENT_5000"))
+        if not bytesIndex:
+            _report("R.byval(bytes(mv).decode())", _timeit("R.byval(bytes(mv).decode())", **ns), "ns")
+        _report("R.bybytes(bytes) ({})".format(label), _timeit("R.bybytes(b)", **ns), "ns")
+        _report("R.bybytes(memoryview slice) ({})".format(label), _timeit("R.bybytes(mv)", **ns), "ns")
+        _report("R.bybytes(bytearray) ({})".format(label), _timeit("R.bybytes(ba)", **ns), "ns")
+        _report("t.bytes ({})".format(label), _timeit("t.bytes", **ns), "ns")
+
+def bench_numpy():
+    "tokens_numpy encode/decode/isin vs Python loops (1000000 tokens, root with 1000 tokens)"
+    try:
+        from tokens_numpy import encode, decode, isin
+    except ImportError:
+        print("  numpy is not installed")
+        return
+    class ArrayToken(Token): pass
+    ArrayToken.makeroot(globalNumIndex=True)
+    class ArrayError(ArrayToken): pass
+    tokens = [ArrayToken("A%d" % i, i) for i in range(900)] + [ArrayError("E%d" % i, 900+i) for i in range(100)]
+    seq = [tokens[i * 7 % 1000] for i in range(1000000)]
+    codes = encode(seq)
+    ns = dict(seq=seq, codes=codes, ints=codes.tolist(), R=ArrayToken, E=ArrayError, 
+                encode=encode, decode=decode, isin=isin)
+    _report("[t.int for t in seq]", _timeit("[t.int for t in seq]", number=3, **ns) / 1e6, "ms")
+    _report("encode(seq)", _timeit("encode(seq)", number=3, **ns) / 1e6, "ms")
+    _report("[R.bynum(i) for i in ints]", _timeit("[R.bynum(i) for i in ints]", number=3, **ns) / 1e6, "ms")
+    _report("decode(codes, R)", _timeit("decode(codes, R)", number=3, **ns) / 1e6, "ms")
+    _report("[t.isof(E) for t in seq]", _timeit("[t.isof(E) for t in seq]", number=3, **ns) / 1e6, "ms")
+    _report("isin(codes, E)", _timeit("isin(codes, E)", number=3, **ns) / 1e6, "ms")
+
+def bench_pandas():
+    "token column vs object column of tokens (1000000 rows, root with 1000 tokens)"
+    try:
+        import pandas as pd
+        from tokens_pandas import TokenArray
+    except ImportError:
+        print("  pandas is not installed")
+        return
+    class FrameToken(Token): pass
+    FrameToken.makeroot()
+    class FrameError(FrameToken): pass
+    tokens = [FrameToken("F%d" % i) for i in range(900)] + [FrameError("E%d" % i) for i in range(100)]
+    strings = pd.Series([tokens[i * 7 % 1000].str for i in range(1000000)])
+    objects = pd.DataFrame({"t": strings.map(FrameToken.byval), "v": 1})
+    column = pd.DataFrame({"t": TokenArray.from_strings(strings, FrameToken), "v": 1})
+    ns = dict(strings=strings, objects=objects, column=column, R=FrameToken, E=FrameError, TokenArray=TokenArray)
+    _report("memory (string column)", strings.memory_usage(index=False, deep=True) / 1e6, "MB")
+    _report("memory (object column of tokens)", objects.t.memory_usage(index=False) / 1e6, "MB")
+    _report("memory (token column)", column.t.memory_usage(index=False) / 1e6, "MB")
+    _report("strings.map(R.byval)", _timeit("strings.map(R.byval)", number=3, **ns) / 1e6, "ms")
+    _report("TokenArray.from_strings(strings, R)", _timeit("TokenArray.from_strings(strings, R)", number=3, **ns) / 1e6, "ms")
+    _report("groupby (object column)", _timeit("objects.groupby('t', sort=False).v.sum()", number=3, **ns) / 1e6, "ms")
+    _report("groupby (token column)", _timeit("column.groupby('t', sort=False).v.sum()", number=3, **ns) / 1e6, "ms")
+    _report("filter isinstance (object column)", 
+                _timeit("objects[objects.t.map(lambda t: isinstance(t, E))]", number=3, **ns) / 1e6, "ms")
+    _report("filter tokens.isof (token column)", _timeit("column[column.t.tokens.isof(E)]", number=3, **ns) / 1e6, "ms")
+
+def bench_arrow():
+    "tokens_arrow decode vs byval per row (1000000 rows, root with 1000 tokens)"
+    try:
+        import pyarrow as pa
+        import tokens_arrow
+    except ImportError:
+        print("  pyarrow is not installed")
+        return
+    class ArrowToken(Token): pass
+    ArrowToken.makeroot()
+    tokens = [ArrowToken("A%d" % i) for i in range(1000)]
+    seq = [tokens[i * 7 % 1000] for i in range(1000000)]
+    column = tokens_arrow.encode(seq)
+    # a dictionary in a different order, as produced by another service
+    order = list(range(999, -1, -1))
+    received = pa.DictionaryArray.from_arrays(pa.array([999 - i for i in column.indices.to_pylist()], type=pa.int32()), 
+                                                column.dictionary.take(pa.array(order)))
+    ns = dict(seq=seq, column=column, received=received, strings=received.cast(pa.string()), 
+                R=ArrowToken, ta=tokens_arrow)
+    _report("[R.byval(s) for s in strings.to_pylist()]", 
+                _timeit("[R.byval(s) for s in strings.to_pylist()]", number=3, **ns) / 1e6, "ms")
+    _report("encode(seq)", _timeit("ta.encode(seq)", number=3, **ns) / 1e6, "ms")
+    _report("decode (own dictionary)", _timeit("ta.decode(column, R)", number=3, **ns) / 1e6, "ms")
+    _report("decode (received dictionary)", _timeit("ta.decode(received, R)", number=3, **ns) / 1e6, "ms")
+    _report("toordinals (received dictionary)", _timeit("ta.toordinals(received, R)", number=3, **ns) / 1e6, "ms")
+
+def bench_codec():
+    "tokens_codec vs pickle (1000000 tokens; roots with 100 and 100000 tokens)"
+    import pickle
+    import tokens_codec
+    global CodecToken, BigCodecToken        # pickle needs importable root classes
+    class CodecToken(Token): pass
+    class BigCodecToken(Token): pass
+    for root, n in ((CodecToken, 100), (BigCodecToken, 100000)):
+        root.makeroot()
+        tokens = [root("C%d" % i) for i in range(n)]
+        seq = [tokens[i * 7 % n] for i in range(1000000)]
+        data, pickled = tokens_codec.encode(seq, root), pickle.dumps(seq, protocol=pickle.HIGHEST_PROTOCOL)
+        ns = dict(seq=seq, data=data, pickled=pickled, R=root, tc=tokens_codec, pickle=pickle)
+        label = "{} tokens".format(n)
+        _report("pickle bytes per token ({})".format(label), len(pickled) / len(seq), "bytes")
+        _report("pickle bytes per token, one by one ({})".format(label), len(pickle.dumps(seq[0], -1)), "bytes")
+        _report("codec bytes per token ({})".format(label), len(data) / len(seq), "bytes")
+        _report("pickle.dumps ({})".format(label), 1e9 / _timeit("pickle.dumps(seq, -1)", number=1, **ns), "M tokens/s")
+        _report("codec encode ({})".format(label), 1e9 / _timeit("tc.encode(seq, R)", number=1, **ns), "M tokens/s")
+        _report("pickle.loads ({})".format(label), 1e9 / _timeit("pickle.loads(pickled)", number=1, **ns), "M tokens/s")
+        _report("codec decode ({})".format(label), 1e9 / _timeit("tc.decode(data, R)", number=1, **ns), "M tokens/s")
+
+def bench_runs():
+    "run encoding of a state log (1000000 tokens in runs of ~100, with timestamps every 10ms)"
+    import io, random
+    import tokens_codec
+    class RunState(Token): pass
+    RunState.makeroot()
+    class RunError(RunState): pass
+    states = [RunState("S%d" % i) for i in range(10)] + [RunError("E%d" % i) for i in range(10)]
+    rng = random.Random(1)
+    seq = []
+    while len(seq) < 1000000:
+        seq += [rng.choice(states)] * rng.randint(1, 200)
+    seq = seq[:1000000]
+    stamps = list(range(0, 10 * len(seq), 10))
+    data = tokens_codec.encode(seq, RunState)
+    runs = tokens_codec.encoderuns(seq, RunState, stamps)
+    ns = dict(seq=seq, stamps=stamps, runs=runs, R=RunState, E=RunError, tc=tokens_codec, io=io)
+    _report("codec bytes per token", len(data) / len(seq), "bytes")
+    _report("runs bytes per token (with timestamps)", len(runs) / len(seq), "bytes")
+    _report("runs encode", 1e9 / _timeit("tc.encoderuns(seq, R, stamps)", number=1, **ns), "M tokens/s")
+    _report("runs decode", 1e9 / _timeit("tc.decoderuns(runs, R)", number=1, **ns), "M tokens/s")
+    _report("count(RunError) on runs", _timeit("tc.RunDecoder(io.BytesIO(runs), R).count(E)", number=1, **ns) / 1e6, "ms")
+    _report("count(RunError) on decoded tokens", _timeit("sum(1 for t in seq if isinstance(t, E))", number=1, **ns) / 1e6, "ms")
+    decoder = tokens_codec.RunDecoder(io.BytesIO(runs), RunState)
+    len(decoder)
+    ns["d"] = decoder
+    _report("random access decoder[i]", _timeit("d[654321]", number=100, **ns) / 1e3, "us")
+
+def bench_shard():
+    "shard routing (10000 tokens, 64 shards)"
+    class ShardToken(Token): pass
+    ShardToken.makeroot()
+    tokens = [ShardToken("T%d" % i) for i in range(10000)]
+    seq = [tokens[i * 7 % 10000] for i in range(1000000)]
+    ns = dict(seq=seq, t=tokens[123], R=ShardToken)
+    _report("token.stablehash", _timeit("t.stablehash", **ns), "ns")
+    _report("token.shard(64) (no shard table)", _timeit("t.shard(64)", number=100000, **ns), "ns")
+    ShardToken.shards(tokens, 64)
+    _report("token.shard(64) (shard table of shards())", _timeit("t.shard(64)", number=100000, **ns), "ns")
+    _report("token.shard(64, str key)", _timeit("t.shard(64, 'user-4711')", number=100000, **ns), "ns")
+    _report("token.shard(64, int key)", _timeit("t.shard(64, 4711)", number=100000, **ns), "ns")
+    _report("Root.shards(1000000 tokens, 64)", 1e9 / _timeit("R.shards(seq, 64)", number=1, **ns), "M tokens/s")
+    _report("hash(token) % 64 (not process-stable)", _timeit("hash(t) % 64", **ns), "ns")
+
+def bench_registry():
+    "cold start from a registry file vs defining the tokens (100000 tokens)"
+    import os, tempfile, time
+    import tokens_registry
+    def makeroot():
+        class RegToken(Token): pass
+        RegToken.makeroot(globalNumIndex=True)
+        class RegError(RegToken): pass
+        return RegToken, RegError
+    def define():
+        root, error = makeroot()
+        for i in range(100000):
+            (error if i % 3 else root)("T%d" % i, i)
+        return root
+    path = os.path.join(tempfile.mkdtemp(), "bench.tokens")
+    start = time.perf_counter()
+    defined = define()
+    _report("define 100000 tokens", (time.perf_counter() - start) * 1e3, "ms")
+    start = time.perf_counter()
+    tokens_registry.compile(defined, path)
+    _report("compile registry file", (time.perf_counter() - start) * 1e3, "ms")
+    start = time.perf_counter()
+    loaded, _ = makeroot()
+    tokens_registry.load(loaded, path)
+    _report("load registry file", (time.perf_counter() - start) * 1e3, "ms")
+    _report("registry file size per token", os.path.getsize(path) / 100000, "bytes")
+    ns = dict(D=defined, L=loaded)
+    _report("byval, defined", _timeit("D.byval('T4711')", **ns), "ns")
+    firstaccess = "L._ordinals._cache.clear(); L._index._hits.clear(); L.byval('T4711')"
+    _report("byval, registry (first access)", _timeit(firstaccess, **ns), "ns")
+    _report("byval, registry (materialized)", _timeit("L.byval('T4711')", **ns), "ns")
+    _report("bynum, registry (materialized)", _timeit("L.bynum(4711)", **ns), "ns")
+    _report("byval miss, registry", _timeit("L.byval('X', True)", **ns), "ns")
+    os.remove(path)
+
+def bench_codegen():
+    "import time of a generated definitions module vs hand-written definitions (10000, 100000 tokens)"
+    import os, shutil, subprocess, tempfile
+    import tokens_codegen
+    directory = tempfile.mkdtemp()
+    def importtime(module):
+        "the import time of module in a fresh interpreter, in ms (after a first import wrote the .pyc)"
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join((directory, os.path.dirname(os.path.abspath(__file__)))))
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+        code = "import time, tokens; t = time.perf_counter(); import {}; print(time.perf_counter() - t)".format(module)
+        subprocess.run([sys.executable, "-c", code], env=env, check=True, capture_output=True)
+        return min(float(subprocess.run([sys.executable, "-c", code], env=env, check=True,
+                        capture_output=True, text=True).stdout) for _ in range(3)) * 1e3
+    for n in (10000, 100000):
+        spec = [{"class": "Gen.GenError" if i % 3 else "Gen", "name": "T%d" % i, "int": i} for i in range(n)]
+        tokens_codegen.generate(spec, os.path.join(directory, "generated%d.py" % n))
+        with open(os.path.join(directory, "handwritten%d.py" % n), "w") as f:
+            f.write("from tokens import Token\nclass Gen(Token): pass\n")
+            f.write("Gen.makeroot(globalIndex=True, globalNumIndex=True)\nclass GenError(Gen): pass\n")
+            for token in spec:
+                f.write('{} = {}("{}", {})\n'.format(token["name"], token["class"].split(".")[-1], token["name"], token["int"]))
+        _report("import hand-written ({} tokens)".format(n), importtime("handwritten%d" % n), "ms")
+        _report("import generated ({} tokens)".format(n), importtime("generated%d" % n), "ms")
+    shutil.rmtree(directory)
+
+def bench_lazy():
+    "lazy root backed by columns vs defined tokens (100000 tokens)"
+    import tokens_lazy
+    def makeroot():
+        class LazyToken(Token): pass
+        LazyToken.makeroot(globalNumIndex=True)
+        return LazyToken
+    names = ["SKU-%07d" % i for i in range(100000)]
+    def define():
+        root = makeroot()
+        for i, name in enumerate(names):
+            root(name, i)
+        return root
+    def lazy():
+        root = makeroot()
+        tokens_lazy.define(root, root, names, range(100000))
+        return root
+    for label, factory in (("defined", define), ("lazy", lazy)):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        root = factory()
+        _report("memory per token ({})".format(label), (tracemalloc.get_traced_memory()[0] - before) / 100000, "bytes")
+        tracemalloc.stop()
+        ns = dict(R=root, factory=factory)
+        _report("create root ({})".format(label), _timeit("factory()", number=1, repeat=3, **ns) / 1e6, "ms")
+        if label == "lazy":
+            firstaccess = "R._ordinals._cache.clear(); R._index._hits.clear(); R.byval('SKU-0004711')"
+            _report("byval (lazy, first access)", _timeit(firstaccess, **ns), "ns")
+        _report("byval ({})".format(label), _timeit("R.byval('SKU-0004711')", **ns), "ns")
+        _report("bynum ({})".format(label), _timeit("R.bynum(4711)", **ns), "ns")
+
+def bench_sqlite():
+    "SQLite backed root (10000000 tokens; creating the database takes about half a minute)"
+    import os, random, shutil, tempfile, time
+    import tokens_sqlite
+    n = 10000000
+    def makeroot():
+        class SqlToken(Token): pass
+        SqlToken.makeroot(globalNumIndex=True)
+        class SqlError(SqlToken): pass
+        return SqlToken, SqlError
+    root, error = makeroot()
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "bench.db")
+    start = time.perf_counter()
+    tokens_sqlite.create(path, root, ((error if i % 3 else root, "SKU-%08d" % i, i) for i in range(n)))
+    _report("create database", time.perf_counter() - start, "s")
+    _report("database size per token", os.path.getsize(path) / n, "bytes")
+    root, _ = makeroot()
+    start = time.perf_counter()
+    tokens_sqlite.load(root, path)
+    _report("load database", (time.perf_counter() - start) * 1e3, "ms")
+    rng = random.Random(1)
+    keys = ["SKU-%08d" % rng.randrange(n) for _ in range(100000)]
+    misses = ["XYZ-%08d" % i for i in range(100000)]
+    ns = dict(R=root, keys=keys, misses=misses, it=iter(keys), mit=iter(misses))
+    _report("byval hit, first access (random keys)", _timeit("R.byval(next(it))", number=20000, repeat=1, **ns), "ns")
+    _report("byval hit, cached", _timeit("R.byval('SKU-00004711')", **ns), "ns")
+    _report("bynum hit, cached", _timeit("R.bynum(4711)", **ns), "ns")
+    _report("byval miss, first time", _timeit("R.byval(next(mit), True)", number=20000, repeat=1, **ns), "ns")
+    _report("byval miss, repeated (negative cache)", _timeit("R.byval('XYZ', True)", **ns), "ns")
+    root._store.close()
+    shutil.rmtree(directory)
+
+def bench_bloom():
+    "miss paths of byval and bynum, with and without a Bloom filter in front of store backed roots"
+    import os, shutil, tempfile, time
+    import tokens_lazy, tokens_sqlite
+    class Defined(Token): pass
+    Defined.makeroot(globalNumIndex=True)
+    for i in range(10000):
+        Defined("SKU-%08d" % i, i)
+    def miss(R):
+        try:
+            R.byval("garbage")
+        except KeyError:
+            pass
+    ns = dict(R=Defined, miss=miss)
+    _report("defined: byval hit", _timeit("R.byval('SKU-00004711')", **ns), "ns")
+    _report("defined: byval miss (KeyError)", _timeit("miss(R)", **ns), "ns")
+    _report("defined: byval miss (noneIfMissing)", _timeit("R.byval('garbage', True)", **ns), "ns")
+    _report("defined: bynum miss (noneIfMissing)", _timeit("R.bynum(-1, True)", **ns), "ns")
+
+    n = 1000000
+    misses = ["XYZ-%08d" % i for i in range(200000)]
+    class Lazy(Token): pass
+    Lazy.makeroot(globalNumIndex=True)
+    tokens_lazy.define(Lazy, Lazy, ["SKU-%08d" % i for i in range(n)], range(n))
+    ns = dict(R=Lazy, misses=misses)
+    _report("lazy: byval miss", _timeit("for v in misses: R.byval(v, True)", number=1, **ns) / len(misses), "ns")
+    _report("lazy: bynum miss", _timeit("for v in range(-200000, 0): R.bynum(v, True)", number=1, **ns) / len(misses), "ns")
+    start = time.perf_counter()
+    strfilter, numfilter = Lazy.usebloomfilter(0.01)
+    _report("lazy: build filters (1000000 tokens)", (time.perf_counter() - start) * 1e3, "ms")
+    _report("filter size per token (1% false positives)", strfilter.nbytes / n, "bytes")
+    _report("lazy: byval miss, filter", _timeit("for v in misses: R.byval(v, True)", number=1, **ns) / len(misses), "ns")
+    _report("lazy: bynum miss, filter", _timeit("for v in range(-200000, 0): R.bynum(v, True)", number=1, **ns) / len(misses), "ns")
+    _report("lazy: byval hit, first access, filter", _timeit("for i in range(0, n, 5): R.byval('SKU-%08d' % i)",
+                number=1, repeat=1, n=n, **ns) / (n // 5), "ns")
+    _report("false positive rate", 100 * sum(v in strfilter for v in misses) / len(misses), "%")
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "bench.db")
+    class Sql(Token): pass
+    Sql.makeroot(globalNumIndex=True)
+    tokens_sqlite.create(path, Sql, ((Sql, "SKU-%08d" % i, i) for i in range(n)))
+    for usefilter in (False, True):
+        class Sql(Token): pass
+        Sql.makeroot(globalNumIndex=True)
+        tokens_sqlite.load(Sql, path, missCacheSize=0)
+        if usefilter:
+            Sql.usebloomfilter(0.01)
+        label = "sqlite: byval miss" + (", filter" if usefilter else "")
+        ns = dict(R=Sql, misses=misses)
+        _report(label, _timeit("for v in misses: R.byval(v, True)", number=1, repeat=3, **ns) / len(misses), "ns")
+        Sql._store.close()
+    shutil.rmtree(directory)
+
+def bench_prefix():
+    "prefix search in a root with 1000000 tokens, against a scan over tokens()"
+    import random, time
+    rng = random.Random(1)
+    groups = ["ERR_DB", "ERR_NET", "ERR_USER", "OK", "WARN"]
+    class Prefixed(Token): pass
+    Prefixed.makeroot(prefixIndex=True)
+    start = time.perf_counter()
+    Prefixed.bulkdefine([Prefixed], [(0, "%s_%07d" % (rng.choice(groups), i)) for i in range(1000000)])
+    _report("bulkdefine (1000000 tokens)", time.perf_counter() - start, "s")
+    start = time.perf_counter()
+    Prefixed.countprefix("")
+    _report("first search (sorts the index)", (time.perf_counter() - start) * 1e3, "ms")
+    ns = dict(R=Prefixed)
+    _report("countprefix('ERR_')", _timeit("R.countprefix('ERR_')", number=10000, **ns), "ns")
+    _report("countprefix('ERR_DB_00012')", _timeit("R.countprefix('ERR_DB_00012')", number=10000, **ns), "ns")
+    _report("byprefix('ERR_DB_', 10)", _timeit("R.byprefix('ERR_DB_', 10)", number=10000, **ns), "ns")
+    _report("byprefix('ERR_DB_00012')", _timeit("R.byprefix('ERR_DB_00012')", number=10000, **ns), "ns")
+    _report("scan of tokens() for 'ERR_DB_00012'", _timeit("[s for s in R.tokens() if s.startswith('ERR_DB_00012')]",
+                number=3, repeat=3, **ns) / 1e6, "ms")
+    counter = iter(range(10**9))
+    ns = dict(R=Prefixed, counter=counter)
+    _report("register a token, then byprefix(.., 10)", _timeit("R('NEW_%d' % next(counter)); R.byprefix('NEW_', 10)",
+                number=10000, **ns), "ns")
+
+def bench_normalize():
+    "lookups of dirty names via bynormalized, against normalizing before byval"
+    from tokens import normalizename
+    class Normalized(Token): pass
+    Normalized.makeroot(normalize=normalizename)
+    for i in range(10000):
+        Normalized("ERR_DB_%05d" % i)
+    dirty = [" err-db-%05d " % i for i in range(100000)]
+    ns = dict(R=Normalized, normalize=normalizename, dirty=dirty)
+    _report("byval('ERR_DB_04711')", _timeit("R.byval('ERR_DB_04711')", **ns), "ns")
+    _report("byval(normalizename(' err-db-04711 '))", _timeit("R.byval(normalize(' err-db-04711 '))", **ns), "ns")
+    _report("bynormalized(' err-db-04711 '), repeated", _timeit("R.bynormalized(' err-db-04711 ')", **ns), "ns")
+    _report("bynormalized, distinct raw values", _timeit("for v in dirty: R.bynormalized(v, True)",
+                number=1, **ns) / len(dirty), "ns")
+    _report("bynormalized(' garbage '), repeated miss", _timeit("R.bynormalized(' garbage ', True)", **ns), "ns")
+
+
+BENCHMARKS = {
+    "layout":   bench_layout,
+    "hash":     bench_hash,
+    "listings": bench_listings,
+    "hierarchy": bench_hierarchy,
+    "tokenset": bench_tokenset,
+    "tokenmap": bench_tokenmap,
+    "freeze":   bench_freeze,
+    "batch":    bench_batch,
+    "bytes":    bench_bytes,
+    "numpy":    bench_numpy,
+    "pandas":   bench_pandas,
+    "arrow":    bench_arrow,
+    "codec":    bench_codec,
+    "runs":     bench_runs,
+    "shard":    bench_shard,
+    "registry": bench_registry,
+    "codegen":  bench_codegen,
+    "lazy":     bench_lazy,
+    "sqlite":   bench_sqlite,
+    "bloom":    bench_bloom,
+    "prefix":   bench_prefix,
+    "normalize": bench_normalize,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print("{}: {}".format(name, BENCHMARKS[name].__doc__))
+        BENCHMARKS[name]()
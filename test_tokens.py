@@ -0,0 +1,113 @@
+"""
+tests for tokens
+
+(c) Stefan LOESCH, topaze.blue 2020.
+
+Licensed under the MIT license https://opensource.org/licenses/MIT
+"""
+import abc
+
+from tokens import Token
+
+
+class LayoutTestToken(Token):
+    __slots__ = ()
+LayoutTestToken.makeroot()
+class LayoutTestChild(LayoutTestToken):
+    __slots__ = ()
+
+def test_slotted_token_classes():
+    "token classes that declare empty slots have no instance __dict__"
+    token = LayoutTestChild("CHILD", 1)
+    assert not hasattr(token, "__dict__")
+    assert isinstance(token, LayoutTestToken) and token.isof(LayoutTestToken)
+    assert (token.str, token.int) == ("CHILD", 1)
+
+def test_token_class_with_abc():
+    "token classes are plain classes, so they combine with other metaclasses"
+    class AbstractToken(Token, abc.ABC): pass
+    AbstractToken.makeroot()
+    token = AbstractToken("ABSTRACT")
+    assert AbstractToken.byval("ABSTRACT") is token
+
+class HierarchyTestToken(Token):
+    __slots__ = ()
+HierarchyTestToken.makeroot()
+class HierarchyTestError(HierarchyTestToken):
+    __slots__ = ()
+class HierarchyTestTimeout(HierarchyTestError):
+    __slots__ = ()
+class HierarchyTestOk(HierarchyTestToken):
+    __slots__ = ()
+
+def test_hierarchy_queries():
+    R, E, T, O = HierarchyTestToken, HierarchyTestError, HierarchyTestTimeout, HierarchyTestOk
+    assert R.issubtoken(T) and E.issubtoken(T) and T.issubtoken(T)
+    assert not E.issubtoken(O) and not T.issubtoken(E)
+    assert T.isparenttoken(R) and T.isparenttoken(E) and not E.isparenttoken(T)
+    assert T.isparenttoken(object) and not T.isparenttoken(int)
+    assert (R.depth(), E.depth(), T.depth()) == (1, 2, 3)
+    assert T.parentclasses(namesOnly=False) == (T, E, R, Token)
+    assert R.allsubclasses(namesOnly=False) == (R, E, T, O)
+
+def test_unused_token_classes_are_collected():
+    "the hierarchy index does not keep token classes alive"
+    import gc, weakref
+    class Temporary(HierarchyTestError): pass
+    ref = weakref.ref(Temporary)
+    assert Temporary in HierarchyTestToken.allsubclasses(namesOnly=False)
+    del Temporary
+    gc.collect()
+    assert ref() is None
+    assert HierarchyTestToken.allsubclasses() == ("HierarchyTestToken", "HierarchyTestError", 
+                                                   "HierarchyTestTimeout", "HierarchyTestOk")
+
+from tokens import FrozenTokenSet, TokenSet
+
+class SetTestToken(Token):
+    __slots__ = ()
+SetTestToken.makeroot()
+class SetTestError(SetTestToken):
+    __slots__ = ()
+SET_TOKENS = [SetTestToken("S%d" % i) for i in range(300)] + [SetTestError("E%d" % i) for i in range(3)]
+
+def test_tokenset_membership():
+    errors = FrozenTokenSet.of(SetTestError)
+    assert SET_TOKENS[-1] in errors and SET_TOKENS[0] not in errors
+    assert SetTestError not in errors and "E0" not in errors and None not in errors
+    assert HierarchyTestToken("NOT_IN_ROOT") not in errors
+
+def test_tokenset_hash_matches_frozenset():
+    tokens = FrozenTokenSet(SET_TOKENS[:2])
+    assert tokens == frozenset(SET_TOKENS[:2])
+    assert frozenset(SET_TOKENS[:2]) in {tokens: 1}
+
+def test_mutable_tokenset_membership_after_updates():
+    tokens = TokenSet((), root=SetTestToken)
+    assert SET_TOKENS[5] not in tokens
+    tokens.add(SET_TOKENS[5])
+    tokens.add(SET_TOKENS[299])
+    assert SET_TOKENS[5] in tokens and SET_TOKENS[299] in tokens
+    tokens.discard(SET_TOKENS[5])
+    assert SET_TOKENS[5] not in tokens
+    tokens |= FrozenTokenSet(SET_TOKENS[:3])
+    assert SET_TOKENS[0] in tokens and tokens.pop() is SET_TOKENS[0]
+    assert SET_TOKENS[0] not in tokens
+    tokens.clear()
+    assert SET_TOKENS[299] not in tokens and not tokens
+
+from tokens import TokenMap
+
+def test_tokenmap_views_compare_like_dict_views():
+    tokens = SET_TOKENS[:5]
+    d = {t: t.str for t in tokens}
+    m = TokenMap(d)
+    assert m.keys() == d.keys() and d.keys() == m.keys()
+    assert m.items() == d.items() and d.items() == m.items()
+    assert list(m.values()) == list(d.values())
+    assert m.keys() & {tokens[0], SET_TOKENS[-1]} == {tokens[0]}
+    assert m.keys() - set(tokens[1:]) == {tokens[0]}
+    assert (tokens[2], "S2") in m.items() and (tokens[2], "X") not in m.items()
+    keys = m.keys()
+    del m[tokens[0]]
+    assert tokens[0] not in keys and len(keys) == 4
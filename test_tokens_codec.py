@@ -0,0 +1,39 @@
+"""
+tests for tokens_codec
+
+(c) Stefan LOESCH, topaze.blue 2020.
+
+Licensed under the MIT license https://opensource.org/licenses/MIT
+"""
+import io
+
+import tokens_codec
+from tokens import Token
+
+
+class CodecTestToken(Token): pass
+CodecTestToken.makeroot()
+TOKENS = [CodecTestToken("T%d" % i) for i in range(20000)]
+
+def test_roundtrip_multibyte_ordinals():
+    "ordinals at and beyond the single byte varint boundaries survive a round trip"
+    for ordinals in ([127], [128], [255], [256], [16384], [130, 1, 3], [127, 128, 255, 256, 16384, 0]):
+        seq = [TOKENS[i] for i in ordinals]
+        assert tokens_codec.decode(tokens_codec.encode(seq, CodecTestToken), CodecTestToken) == seq
+
+def test_roundtrip_write_and_writemany():
+    "write and writemany produce the same stream"
+    seq = [TOKENS[i] for i in (0, 127, 128, 255, 256, 16384, 1)]
+    file = io.BytesIO()
+    with tokens_codec.Encoder(file, CodecTestToken) as encoder:
+        for token in seq:
+            encoder.write(token)
+    assert file.getvalue() == tokens_codec.encode(seq, CodecTestToken)
+    assert tokens_codec.decode(file.getvalue(), CodecTestToken) == seq
+
+def test_writemany_caches_no_per_root_table():
+    "writemany encodes the ordinals of the batch, not a table of all ordinals of the root"
+    seq = [TOKENS[19999], TOKENS[128], TOKENS[19999]]
+    data = tokens_codec.encode(seq, CodecTestToken)
+    assert tokens_codec.decode(data, CodecTestToken) == seq
+    assert not any(key.startswith("codec.") for key in CodecTestToken._classlistings())
@@ -0,0 +1,24 @@
+"""
+tests for tokens_codegen
+
+(c) Stefan LOESCH, topaze.blue 2020.
+
+Licensed under the MIT license https://opensource.org/licenses/MIT
+"""
+import pytest
+
+from tokens_codegen import validate
+
+
+def test_validate_int_index():
+    "the root gets a global int index if all tokens have an int value"
+    spec = [{"class": "Gen", "name": "A", "int": 1}, {"class": "Gen.Sub", "name": "B", "int": 2}]
+    assert validate(spec) == (["Gen", "Gen.Sub"], True)
+    assert validate(spec[:1] + [{"class": "Gen", "name": "B"}]) == (["Gen"], False)
+
+def test_validate_duplicate_ints():
+    "duplicate int values raise if all tokens have one, rather than dropping the int index"
+    spec = [{"class": "Gen", "name": "A", "int": 1}, {"class": "Gen", "name": "B", "int": 1}]
+    with pytest.raises(RuntimeError):
+        validate(spec)
+    assert validate(spec + [{"class": "Gen", "name": "C"}]) == (["Gen"], False)
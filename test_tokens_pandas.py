@@ -0,0 +1,56 @@
+"""
+tests for tokens_pandas (skipped if pandas is not installed)
+
+(c) Stefan LOESCH, topaze.blue 2020.
+
+Licensed under the MIT license https://opensource.org/licenses/MIT
+"""
+import pytest
+
+pd = pytest.importorskip("pandas")
+np = pytest.importorskip("numpy")
+
+from tokens import Token
+from tokens_pandas import TokenArray, TokenDtype
+
+
+class PandasTestState(Token): pass
+PandasTestState.makeroot()
+class PandasTestError(PandasTestState): pass
+OK, BUSY = PandasTestState("OK"), PandasTestState("BUSY")
+FAILED = PandasTestError("FAILED")
+
+class PandasTestOther(Token): pass
+PandasTestOther.makeroot()
+OTHER = PandasTestOther("OTHER")
+
+def test_from_strings_and_isof():
+    "strings are looked up in the root, unknown strings become missing"
+    array = TokenArray.from_strings(["OK", "FAILED", "NOPE", None, "OK"], PandasTestState)
+    assert list(array) == [OK, FAILED, None, None, OK]
+    assert array.isna().tolist() == [False, False, True, True, False]
+    assert array.isof(PandasTestError).tolist() == [False, True, False, False, False]
+
+def test_eq_across_roots():
+    "tokens of different roots never compare equal, even with the same ordinal"
+    array = TokenArray([0, 0], PandasTestState)
+    other = TokenArray([0, 0], PandasTestOther)
+    assert (array == TokenArray([0, 1], PandasTestState)).tolist() == [True, False]
+    assert (array == other).tolist() == [False, False]
+    assert (array != other).tolist() == [True, True]
+    assert (array == OTHER).tolist() == [False, False]
+
+def test_from_sequence_string_dtype():
+    "a dtype given by its string name is converted before its root is used"
+    name = TokenDtype(PandasTestState).name
+    array = TokenArray._from_sequence([OK, "BUSY", None], dtype=name)
+    assert array.dtype == TokenDtype(PandasTestState)
+    assert list(array) == [OK, BUSY, None]
+    series = pd.Series(["OK", "FAILED"]).astype(name)
+    assert list(series) == [OK, FAILED]
+
+def test_series_groupby_and_accessor():
+    column = pd.Series(TokenArray.from_strings(["OK", "FAILED", "OK", "BUSY"], PandasTestState))
+    assert column[column.tokens.isof(PandasTestError)].tolist() == [FAILED]
+    counts = column.groupby(column, sort=False).size()
+    assert dict(zip(counts.index, counts)) == {OK: 2, FAILED: 1, BUSY: 1}
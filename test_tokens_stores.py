@@ -0,0 +1,173 @@
+"""
+tests for store backed roots (tokens_lazy, tokens_registry, tokens_sqlite)
+
+(c) Stefan LOESCH, topaze.blue 2020.
+
+Licensed under the MIT license https://opensource.org/licenses/MIT
+"""
+import gc
+import pickle
+
+import pytest
+
+import tokens_lazy
+import tokens_registry
+import tokens_sqlite
+from tokens import Token
+
+N = 1000
+CACHESIZE = 10
+
+# the store backed roots are module level classes, so that their tokens pickle
+
+class LazyStoreToken(Token):
+    __slots__ = ()
+LazyStoreToken.makeroot(globalNumIndex=True)
+class LazyStoreChild(LazyStoreToken):
+    __slots__ = ()
+
+class RegistryStoreToken(Token):
+    __slots__ = ()
+RegistryStoreToken.makeroot(globalNumIndex=True)
+class RegistryStoreChild(RegistryStoreToken):
+    __slots__ = ()
+
+class SqliteStoreToken(Token):
+    __slots__ = ()
+SqliteStoreToken.makeroot(globalNumIndex=True)
+class SqliteStoreChild(SqliteStoreToken):
+    __slots__ = ()
+
+def _rows(root, child):
+    "the rows (class, str, int) of the test tokens; every third token is of the root class"
+    return [(root if i % 3 == 0 else child, "T%d" % i, 10 * i) for i in range(N)]
+
+def _source(root, child):
+    "an in-memory root with the same names and tokens as root (the source of its store)"
+    source = type(root.__name__, (Token,), {"__slots__": ()})
+    source.makeroot(globalNumIndex=True)
+    sourcechild = type(child.__name__, (source,), {"__slots__": ()})
+    source.bulkdefine([source, sourcechild], [(c is child, strval, intval) for c, strval, intval in _rows(root, child)])
+    return source, sourcechild
+
+@pytest.fixture(scope="module", params=["lazy", "registry", "sqlite"])
+def roots(request, tmp_path_factory):
+    "(store backed root, its child class, in-memory source root, its child class)"
+    path = tmp_path_factory.mktemp(request.param)
+    if request.param == "lazy":
+        root, child = LazyStoreToken, LazyStoreChild
+        source, sourcechild = _source(root, child)
+        classes, strings, ints = zip(*_rows(root, child))
+        tokens_lazy.define(root, classes, strings, ints, cacheSize=CACHESIZE)
+    elif request.param == "registry":
+        root, child = RegistryStoreToken, RegistryStoreChild
+        source, sourcechild = _source(root, child)
+        tokens_registry.compile(source, path / "test.tokens")
+        tokens_registry.load(root, path / "test.tokens", cacheSize=CACHESIZE)
+    else:
+        root, child = SqliteStoreToken, SqliteStoreChild
+        source, sourcechild = _source(root, child)
+        tokens_sqlite.create(path / "test.db", root, _rows(root, child))
+        tokens_sqlite.load(root, path / "test.db", cacheSize=CACHESIZE)
+    return root, child, source, sourcechild
+
+def _countrows(monkeypatch, root):
+    "a list that counts the rows read from the store of root from now on"
+    store, calls = root._store, []
+    row = store.row
+    def countingrow(ordinal):
+        calls.append(ordinal)
+        return row(ordinal)
+    monkeypatch.setattr(store, "row", countingrow)
+    return calls
+
+def test_byval_and_bynum(roots):
+    "tokens are found by string and int value, with their class and values from the store"
+    root, child, _, _ = roots
+    token = root.byval("T5")
+    assert type(token) is child and (token.str, token.int) == ("T5", 50)
+    assert type(root.byval("T6")) is root
+    assert root.bynum(50) is token
+    assert root.byval("NOPE", noneIfMissing=True) is None
+    assert root.bynum(51, noneIfMissing=True) is None
+    with pytest.raises(KeyError):
+        root.byval("NOPE")
+
+def test_subclasses_and_tokens(roots):
+    "subclasses and (paged) token listings agree with the in-memory source root"
+    root, child, source, sourcechild = roots
+    assert root.subclasses() == (root.__name__, child.__name__)
+    assert child.subclasses(namesOnly=False) == (child,)
+    for cls, sourcecls in ((root, source), (child, sourcechild)):
+        assert cls.tokens() == sourcecls.tokens()
+        for offset, limit in ((0, None), (5, 10), (330, 10), (332, 5), (N - 2, 10), (N + 5, 3), (0, 0)):
+            assert cls.tokens(True, offset, limit) == sourcecls.tokens(True, offset, limit), (offset, limit)
+            assert tuple(t.str for t in cls.tokens(False, offset, limit)) == sourcecls.tokens(True, offset, limit)
+
+def test_paged_tokens_only_read_the_page(roots, monkeypatch):
+    "tokens(offset, limit) reads only the rows of the requested tokens, across class boundaries"
+    root, _, source, _ = roots
+    gc.collect()
+    calls = _countrows(monkeypatch, root)
+    offset = len(source._register[source]) - 2
+    page = root.tokens(False, offset, 4)
+    assert tuple(t.str for t in page) == source.tokens(True, offset, 4)
+    assert len(calls) <= 4
+
+def test_identity_under_cache_size(roots):
+    "tokens that are still referenced stay the same object, beyond cacheSize and gc"
+    root, _, _, _ = roots
+    token = root.byval("T7")
+    ordinal = root.ordinal(token)
+    root.tokens(False)
+    gc.collect()
+    assert root.byval("T7") is token
+    assert root.bynum(70) is token
+    assert root.byordinal(ordinal) is token
+    del token
+    gc.collect()
+    assert len(root._ordinals._cache) <= CACHESIZE + 1
+    assert root.ordinal(root.byval("T7")) == ordinal
+
+def test_pickle_roundtrip(roots, monkeypatch):
+    "tokens unpickle to the same object, through the cached registers of the root"
+    root, _, _, _ = roots
+    token, other = root.byval("T8"), root.byval("T9")
+    assert pickle.loads(pickle.dumps(token)) is token
+    registers = root._classlistings()["unpickle.registers"]
+    calls = _countrows(monkeypatch, root)
+    assert pickle.loads(pickle.dumps([other, token])) == [other, token]
+    assert pickle.loads(pickle.dumps(other)) is other
+    assert root._classlistings()["unpickle.registers"] is registers
+    assert set(calls) <= {root.ordinal(token), root.ordinal(other)}
+
+def test_shard_of_one_token(roots, monkeypatch):
+    "shard and shards of single tokens do not materialize the root, and agree with the source"
+    root, _, source, _ = roots
+    token = root.byval("T10")
+    calls = _countrows(monkeypatch, root)
+    assert token.shard(8) == source.byval("T10").shard(8)
+    assert root.shards([token], 8) == [token.shard(8)]
+    assert "shards" not in root._classlistings()
+    assert calls == []
+
+def test_bloom_filter_misses(roots, monkeypatch):
+    "with a Bloom filter most misses do not reach the store, and hits are unaffected"
+    root, child, _, _ = roots
+    strfilter, intfilter = root.usebloomfilter(0.01)
+    assert len(strfilter) == len(intfilter) == N
+    store, finds = root._store, []
+    for name in ("find", "findint"):
+        method = getattr(store, name)
+        monkeypatch.setattr(store, name, lambda value, method=method: finds.append(value) or method(value))
+    for i in range(100):
+        assert root.byval("MISSING%d" % i, noneIfMissing=True) is None
+        assert root.bynum(10 * i + 1, noneIfMissing=True) is None
+    assert len(finds) < 20
+    assert type(root.byval("T11")) is child and root.bynum(110) is root.byval("T11")
+
+def test_fingerprint_matches_source(roots):
+    "the fingerprint of a loaded store is the fingerprint of the root it was created from"
+    root, _, source, _ = roots
+    assert root.fingerprint() == source.fingerprint()
+    assert root.rootname() == source.rootname()
@@ -9,7 +9,29 @@ __version__ = "1.2.2"
 __author__ = "Stefan Loesch, topaze.blue"
 __license__ = "MIT"
 
+import hashlib
+import math
+import sys
+from bisect import bisect_left
 from collections import namedtuple, OrderedDict
+from heapq import merge
+from collections.abc import ItemsView, Mapping, MutableMapping, Sequence, ValuesView
+from itertools import repeat
+from types import MappingProxyType
+import weakref
+from weakref import WeakValueDictionary
+
+NORMALIZECACHESIZE = 10000
+SHARDTABLES = 4
+KEYHASHCACHESIZE = 10000
+
+def normalizename(strval):
+    """
+    the normalized form of a token name: upper case, with runs of whitespace, dashes and
+    underscores replaced by a single underscore, and stripped of them at both ends
+    (eg " err-db  timeout " -> "ERR_DB_TIMEOUT"; see `Token.bynormalized`)
+    """
+    return "_".join(strval.replace("-", " ").replace("_", " ").split()).upper()
 
 class Token:
     """
@@ -53,11 +75,90 @@ class Token:
         somewhere and imported from there, so there is one and only one of this objects present
         and a comparison with `is` is appropriate.
 
-        There is one important exception to this however: when Tokens had been pickled and are
-        restored by unpickle then the unpickled Token objects are _distinct_ from the locally
-        defined ones, and therefore `is` comparisions WILL FAIL. 
+        This also holds across pickle and copy: tokens are pickled by reference (root class,
+        class qualname and string value) and unpickle to the registered token in the receiving
+        process, which must therefore define the same tokens; `copy.copy` and `copy.deepcopy`
+        return the token itself.
+
+    ORDINALS
+
+    Every token gets a dense ordinal 0..N-1 within its root (Token itself being the root of
+    all tokens outside a makeroot() hierarchy), in order of definition. It is returned by
+    `Root.ordinal(token)` and by `operator.index(token)`, so tokens can index lists and arrays
+    directly, and `Root.byordinal(i)` retrieves the token. Note that because of `__index__`
+    also `int(token)` returns the ordinal; the int value of the token is `token.int`.
+
+    CLASS HIERARCHY INDEX
+
+    Every token class is indexed when it is defined (via `__init_subclass__`), whether or not
+    it has any tokens: it keeps the frozenset of its token parent classes, so that `issubtoken`
+    and `isparenttoken` are a single set lookup, and `parentclasses` and `depth` return
+    precomputed values; `allsubclasses` lists the classes defined under a class (which are
+    only weakly referenced, so that unused token classes can still be garbage collected).
+
+    STABLE HASH
+
+    `hash(token)` is an identity hash and differs between processes; `token.stablehash` is a
+    64 bit hash of the class path ("<module>:<qualname>") and string value of the token that
+    is computed on first access and is the same everywhere, and `token.shard(n)` (or
+    `Root.shards(tokens, n)` for many tokens) maps tokens, or (token, key) pairs, to n shards
+    via jump consistent hashing. Note that the class path depends on the module the class is
+    defined in, so token classes must be defined in a module, not in `__main__`, to shard the
+    same way in all processes.
+
+    FINGERPRINT
+
+    `Root.fingerprint()` returns a 16 byte digest of the class names, strings and ints of all
+    tokens of the root in order of definition; it is maintained incrementally on registration,
+    so a producer and a consumer of ordinals or int values can check in O(1) that they have
+    the same token definitions (tokens_codec embeds it in its stream headers).
+
+    BYTES LOOKUP
+
+    Roots created with `makeroot(bytesIndex=True)` also index their tokens by their utf-8
+    encoded string values, so that `Root.bybytes(view)` looks up slices of received buffers
+    without decoding them; the index and the encoded value kept on every token cost about 70
+    bytes per token, so other roots decode the value in `bybytes` instead.
+
+    PREFIX SEARCH
+
+    Roots created with `makeroot(prefixIndex=True)` keep the string values of their tokens
+    sorted, so that `Root.byprefix("ERR_DB_", limit)` and `Root.countprefix("ERR_DB_")` are
+    binary searches (eg for autocompletion) rather than scans over `Root.tokens()`.
+
+    NORMALIZED LOOKUP
+
+    Roots created with `makeroot(normalize=normalizename)` (or any other function str -> str)
+    also index their tokens by normalized string value, which must be unique across the root
+    (checked at registration), so that `Root.bynormalized(" err-db ")` finds ERR_DB; the
+    results for recent raw values are cached, so repeated dirty inputs are not normalized again.
+
+    STORES
+
+    `Root.usestore(store)` backs a root by a read-only TokenStore (eg a memory-mapped registry
+    file, see tokens_registry) instead of tokens defined one by one; the tokens are created
+    when they are first looked up, and are singletons as any other token. `Root.usebloomfilter()`
+    puts a Bloom filter in front of the store, so that lookups of values that are not tokens
+    rarely reach it.
+
+    FREEZING
 
-        To avoid this, the objects should always be compared using `==`.
+    Once all tokens of a root have been defined, `Root.freeze()` (or `Token.freeze(allRoots=True)`
+    for all roots) rebuilds its registers into read-optimized structures and prebuilds all
+    listings; registering a token in a frozen root raises a RuntimeError.
+
+    MEMORY LAYOUT
+
+    Tokens are slotted, and their values live directly on the token (`_str`, `_int`, ...)
+    rather than in a separate TokenValue object; the `val` property still returns a TokenValue
+    (the one passed in at creation, or one built on first access). Token classes should declare
+    `__slots__ = ()` to stay free of a per-instance `__dict__` (about 30 bytes per token):
+
+        class Status(Token):
+            __slots__ = ()
+
+    (a metaclass could add it to every token class, but it would take `isinstance` and
+    `issubclass` off CPython's fast path, which costs more than the memory it saves).
 
     TOKEN HIERARCHIES
 
@@ -110,7 +211,11 @@ class Token:
     """
     __version__ = __version__
 
+    __slots__ = ("_str", "_int", "_float", "_dict", "_list", "_val", "_bytes", "_ordinal", "_stablehash", "__weakref__")
+
     class TokenValue:
+        __slots__ = ("strval", "intval", "floatval", "dictval", "listval")
+
         def __init__(s, strval=None, intval=None, floatval=None, dictval=None, listval=None):
             s.strval = strval
             s.intval = intval
@@ -122,46 +227,75 @@ class Token:
             return "TokenValue({}, {}, {}, {}, {})".format(s.strval, s.intval, s.floatval, s.dictval, s.listval)
             
     _register = OrderedDict()
+    _bytesindex = None
+    _prefixindex = None
+    _normalize = None
+    _ordinals = []
+    _subregister = {}
+    _listings = {}
     def __init__(s, strval=None, intval=None, floatval=None, dictval=None, listval=None, val=None):
         if val is None:
-            s._val = s.TokenValue(strval, intval, floatval, dictval, listval)
+            s._str, s._int, s._float, s._dict, s._list = strval, intval, floatval, dictval, listval
         else:
-            s._val = val
+            s._str, s._int, s._float, s._dict, s._list = val.strval, val.intval, val.floatval, val.dictval, val.listval
+        s._val = val
 
-        if s._val.strval is None:
-            raise RuntimeError("token must have a string value", s._val)
+        if s._str is None:
+            raise RuntimeError("token must have a string value", s.val)
+        if s._frozen:
+            raise RuntimeError("cannot register a token in a frozen root", s._str, s._root)
+        s._bytes = s._str.encode() if s._bytesindex is not None and isinstance(s._str, str) else None
+        s._stablehash = None
 
-        # we now update the central token register; this register is indexed by class
+        # we now check the central token register; this register is indexed by class
         # within the class the register is organised by Token string, and this string
-        # must be unique for a given class
-        try:
-            register = s._register[s.__class__]
-        except KeyError:
-            s._register[s.__class__] = OrderedDict()
-            register = s._register[s.__class__]
-        if s.str in register:
+        # must be unique for a given class; the string and numerical registers, if they
+        # exist, must also be unique; the token is only registered once all checks passed
+        register = s._register.get(s.__class__, ())
+        if s._str in register:
             raise RuntimeError("Token must be globally unique in this micro segment", s.str, s, register[s.str])
-        register[s.str] = s
-
-        # we now update the string an numerical registers, if they exist
-        try:
-            index = s._index
-            if s.str in index:
-                raise RuntimeError("Token must be globally unique in this segment", s.str, s, index[s.str])
-            index[s.str] = s
-        except AttributeError:
-            pass
-
-        try:
-            index = s._numindex
-            if s.int in index:
-                raise RuntimeError("Token must be globally unique in this segment", s.int, s, index[s.int])
-            index[s.int] = s
-        except AttributeError:
-            pass
+        index = getattr(s, "_index", None)
+        if index is not None and s._str in index:
+            raise RuntimeError("Token must be globally unique in this segment", s.str, s, index[s.str])
+        numindex = getattr(s, "_numindex", None)
+        if numindex is not None and s._int in numindex:
+            raise RuntimeError("Token must be globally unique in this segment", s.int, s, numindex[s.int])
+        normalize = s._normalize
+        if normalize is not None:
+            normval = normalize(s._str)
+            if normval in s._normindex:
+                raise RuntimeError("Token must be unique under normalization in this segment", s.str, normval,
+                                    s._ordinals[s._normindex[normval]])
+
+        if not register:
+            register = s._register[s.__class__] = OrderedDict()
+            s._registerclass()
+        register[s._str] = s
+        if index is not None:
+            index[s._str] = s
+            if s._bytes is not None:
+                s._bytesindex[s._bytes] = s
+            if s._prefixindex is not None:
+                s._prefixindex.add(s._str)
+        if numindex is not None:
+            numindex[s._int] = s
+
+        # the ordinal is dense within the root, ie 0..N-1 in order of definition
+        s._ordinal = len(s._ordinals)
+        s._ordinals.append(s)
+        if normalize is not None:
+            s._normindex[normval] = s._ordinal
+            s._normcache.clear()
+        s._fingerprinter.update(repr((s.__class__.__qualname__, s._str, s._int)).encode())
+
+        # the cached listings of this class and all its parents up to the root are now stale
+        listings = s._listings
+        for c in s._rootmro():
+            listings.pop(c, None)
 
     @classmethod
-    def makeroot(cls, globalIndex=True, globalNumIndex=False):
+    def makeroot(cls, globalIndex=True, globalNumIndex=False, prefixIndex=False, normalize=None,
+                    normalizeCacheSize=NORMALIZECACHESIZE, bytesIndex=False):
         """
         make this class a root class (must be called BEFORE any tokens are created)
 
@@ -169,14 +303,336 @@ class Token:
                             globally unique in STRING index and indexed (default: True)
         :globalNumIndex:    whether all tokens in the class and its subclasses should be 
                             globally unique in INT index and indexed (default: False)
+        :prefixIndex:       whether the string values should also be kept sorted for prefix
+                            searches (see `byprefix`; requires globalIndex; default: False)
+        :normalize:         a function str -> str (eg `normalizename`); if given, all tokens in
+                            the class and its subclasses must be globally unique in their
+                            normalized STRING value, which is indexed (see `bynormalized`)
+        :normalizeCacheSize: the number of raw values remembered by `bynormalized`
+        :bytesIndex:        whether the tokens should also be indexed by their utf-8 encoded
+                            string values (see `bybytes`; requires globalIndex; default: False)
         """
+        if cls.__dict__.get("_frozen"):
+            raise RuntimeError("cannot make a frozen root a root again", cls)
+        if bytesIndex and not globalIndex:
+            raise RuntimeError("a bytes index requires a global index", cls)
+        if prefixIndex and not globalIndex:
+            raise RuntimeError("a prefix index requires a global index", cls)
+        cls._root = cls
+        cls._frozen = False
+        if cls not in cls._roots:
+            cls._roots.append(cls)
         cls._register = OrderedDict()
+        cls._ordinals = []
+        cls._subregister = {}
+        cls._listings = {}
+        cls._fingerprinter = hashlib.blake2b(digest_size=16)
+        cls._store = None
+        cls._bytesindex = {} if bytesIndex else None
+        cls._prefixindex = _PrefixIndex() if prefixIndex else None
+        cls._normalize = None if normalize is None else staticmethod(normalize)
+        cls._normindex = {}
+        cls._normcache = OrderedDict()
+        cls._normcachesize = normalizeCacheSize
         if globalIndex:
             cls._index = OrderedDict()
 
         if globalNumIndex:
             cls._numindex = OrderedDict()
 
+    @classmethod
+    def freeze(cls, allRoots=False):
+        """
+        freeze the root of this class, so that no further tokens can be registered in it
+
+        :allRoots:      if True, freeze all roots (including Token itself)
+
+        the registers of the root are rebuilt into read-optimized structures (plain dicts
+        behind mapping proxies, tuples), and all listings (`tokens`, `subclasses`, token set
+        masks) are built once, so that after freezing all of them are cache hits; any
+        attempt to register a token in a frozen root raises a RuntimeError
+        """
+        roots = tuple(cls._roots) if allRoots else (cls._root,)
+        for root in roots:
+            if root._frozen: continue
+            for c in root._subregister:
+                c.tokens(strOnly=True)
+                c.tokens(strOnly=False)
+                c.subclasses(namesOnly=True)
+                c.subclasses(namesOnly=False)
+                c._tokenmask()
+            root._register = MappingProxyType({c: MappingProxyType(dict(r)) for c, r in root._register.items()})
+            root._subregister = {c: tuple(r) for c, r in root._subregister.items()}
+            root._ordinals = tuple(root._ordinals)
+            if "_index" in root.__dict__:
+                root._index = dict(root._index)
+            if root._prefixindex is not None:
+                root._prefixindex.compact()
+            if "_numindex" in root.__dict__:
+                root._numindex = dict(root._numindex)
+            root._frozen = True
+
+    @classmethod
+    def rootname(cls):
+        "the name of the root of this class (\"<module>:<qualname>\"), as used in stream and file headers"
+        root = cls._root
+        return "{}:{}".format(root.__module__, root.__qualname__)
+
+    @classmethod
+    def fingerprint(cls):
+        """
+        16 byte digest of the token definitions of the root of this class
+
+        the digest covers the class name, string and int value of every token of the root,
+        in order of definition (ie ordinal order); it is updated as tokens are registered and
+        cached until the next registration, so that it can be embedded in and compared
+        against every message that carries ordinals or int values of the tokens
+        """
+        root = cls._root
+        listings = root._classlistings()
+        try:
+            return listings["fingerprint"]
+        except KeyError:
+            if root._store is not None:
+                result = listings["fingerprint"] = root._store.fingerprint()
+            else:
+                result = listings["fingerprint"] = root._fingerprinter.digest()
+            return result
+
+    @classmethod
+    def usestore(cls, store, cacheSize=None):
+        """
+        back the root of this class by a read-only token store (see TokenStore)
+
+        :store:         the TokenStore holding the tokens of the root
+        :cacheSize:     the number of materialized tokens that are kept alive (default: None,
+                        ie all of them); tokens that are still referenced elsewhere are always
+                        kept, so that lookups return the same object as long as it exists
+
+        the root must have been created with makeroot() and must not have any tokens; the
+        token classes of the store are looked up by qualname among the subclasses of the
+        root, and created if they do not exist; tokens are created (without running their
+        `__init__`) when they are first looked up, and the root is frozen
+        """
+        root = cls._root
+        if root is Token:
+            raise RuntimeError("usestore requires a root created with makeroot()")
+        if root._ordinals or root._frozen:
+            raise RuntimeError("usestore requires a root without tokens that is not frozen", root)
+        storeclasses = store.classes()
+        byname = {c.__qualname__: c for c in root.allsubclasses(namesOnly=False)}
+        classes = [None] * len(storeclasses)
+        def resolve(i):
+            if classes[i] is None:
+                qualname, parent, _ = storeclasses[i]
+                tokenclass = byname.get(qualname)
+                if (parent < 0) != (tokenclass is root):
+                    raise RuntimeError("token store is for a different root", qualname, root)
+                if tokenclass is None:
+                    tokenclass = type(qualname.rsplit(".", 1)[-1], (resolve(parent),),
+                                        {"__module__": root.__module__, "__qualname__": qualname, "__slots__": ()})
+                classes[i] = tokenclass
+            return classes[i]
+        for i in range(len(classes)):
+            resolve(i)
+        tokens = _StoreTokens(store, classes, cacheSize)
+        register, subregister = {}, {}
+        for i, (qualname, parent, count) in enumerate(storeclasses):
+            if not count: continue
+            register[classes[i]] = _StoreClassRegister(store, tokens, i, count)
+            for c in classes[i]._rootmro():
+                subregister.setdefault(c, []).append(classes[i])
+        if root._normalize is not None:
+            normindex = {}
+            for ordinal, strval in enumerate(store.strings()):
+                normval = root._normalize(strval)
+                if normval in normindex:
+                    raise RuntimeError("Token must be unique under normalization in this segment", strval, normval)
+                normindex[normval] = ordinal
+            root._normindex = normindex
+            root._normcache = OrderedDict()
+        root._store = store
+        root._ordinals = tokens
+        root._register = MappingProxyType(register)
+        root._subregister = {c: tuple(r) for c, r in subregister.items()}
+        root._listings = {}
+        if "_index" in root.__dict__:
+            root._index = _StoreIndex(store, tokens)
+            if root._bytesindex is not None:
+                root._bytesindex = _StoreBytesIndex(root._index)
+            if root._prefixindex is not None:
+                root._prefixindex = _PrefixIndex(store.strings())
+        if "_numindex" in root.__dict__:
+            root._numindex = _StoreNumIndex(store, tokens)
+        root._frozen = True
+
+    @classmethod
+    def usebloomfilter(cls, falsePositiveRate=0.01):
+        """
+        put a Bloom filter in front of the store lookups of the store backed root of this class
+
+        :falsePositiveRate:     the probability that the filter lets a missing value through
+                                to the store (default: 0.01)
+        :returns:               the tuple of the filters (string values, int values), None for
+                                an index the root does not have
+
+        the filters are built once from all string and int values of the store; afterwards
+        `byval`, `bynum` (and everything built on them) answer most lookups of values that
+        are not tokens in a few hash operations, without probing the store (eg a query of
+        tokens_sqlite); lookups of tokens that are already materialized do not consult the
+        filter; roots whose tokens are defined in memory do not need a filter, as the lookup
+        in their index is cheaper than the filter, and `byval(value, noneIfMissing=True)`
+        does not raise internally on a miss
+        """
+        root = cls._root
+        store = root._store
+        if store is None:
+            raise RuntimeError("Bloom filters are only used by store backed roots (see usestore)", root)
+        filters = []
+        for name, values in (("_index", store.strings), ("_numindex", store.ints)):
+            if name not in root.__dict__:
+                filters.append(None)
+                continue
+            index = root.__dict__[name]
+            bloomfilter = _BloomFilter(len(store), falsePositiveRate)
+            bloomfilter.update(values())
+            index._filter = bloomfilter
+            filters.append(bloomfilter)
+        return tuple(filters)
+
+    @classmethod
+    def _create(cls, ordinal, strval, intval=None, floatval=None, dictval=None, listval=None):
+        "a token of this class created without `__init__` or registration (see `usestore`, `bulkdefine`)"
+        s = object.__new__(cls)
+        s._str, s._int, s._float, s._dict, s._list, s._val = strval, intval, floatval, dictval, listval, None
+        s._bytes = strval.encode() if cls._bytesindex is not None and isinstance(strval, str) else None
+        s._stablehash = None
+        s._ordinal = ordinal
+        return s
+
+    @classmethod
+    def bulkdefine(cls, classes, rows, validate=True):
+        """
+        define many tokens in the root of this class at once (eg from generated code)
+
+        :classes:       a sequence of token classes under the root
+        :rows:          an iterable of tuples (class index, strval, intval, floatval, dictval,
+                        listval); trailing values can be omitted
+        :validate:      if False, skip the uniqueness checks (only for definitions that have
+                        been validated before, see tokens_codegen)
+        :returns:       the list of the new tokens
+
+        the tokens are the same as if they had been created one by one in the order of the
+        rows, but the registers and indexes are filled in bulk, and the `__init__` of the
+        token classes is not run; on a validation error no token is registered
+        """
+        root = cls._root
+        if root._frozen:
+            raise RuntimeError("cannot register a token in a frozen root", root)
+        for tokenclass in classes:
+            if tokenclass._root is not root:
+                raise RuntimeError("all classes must belong to the same root", tokenclass, root)
+        base = len(root._ordinals)
+        tokens = [classes[row[0]]._create(base + i, *row[1:]) for i, row in enumerate(rows)]
+        index = root.__dict__.get("_index")
+        numindex = root.__dict__.get("_numindex")
+        if validate:
+            seen = {}
+            for token in tokens:
+                if token._str is None:
+                    raise RuntimeError("token must have a string value", token.val)
+                register = seen.setdefault(token.__class__, set(root._register.get(token.__class__, ())))
+                if token._str in register:
+                    raise RuntimeError("Token must be globally unique in this micro segment", token._str)
+                register.add(token._str)
+            for existing, attr in ((index, "_str"), (numindex, "_int")):
+                if existing is None: continue
+                values = set()
+                for token in tokens:
+                    value = getattr(token, attr)
+                    if value in existing or value in values:
+                        raise RuntimeError("Token must be globally unique in this segment", value)
+                    values.add(value)
+        normalize = root._normalize
+        if normalize is not None:
+            normvals = [normalize(token._str) for token in tokens]
+            if validate:
+                values = set()
+                for token, normval in zip(tokens, normvals):
+                    if normval in root._normindex or normval in values:
+                        raise RuntimeError("Token must be unique under normalization in this segment",
+                                            token._str, normval)
+                    values.add(normval)
+        register = root._register
+        for token in tokens:
+            tokenclass = token.__class__
+            try:
+                register[tokenclass][token._str] = token
+            except KeyError:
+                register[tokenclass] = OrderedDict(((token._str, token),))
+                tokenclass._registerclass()
+        if index is not None:
+            index.update((t._str, t) for t in tokens)
+            if root._bytesindex is not None:
+                root._bytesindex.update((t._bytes, t) for t in tokens if t._bytes is not None)
+            if root._prefixindex is not None:
+                root._prefixindex.update(t._str for t in tokens)
+        if numindex is not None:
+            numindex.update((t._int, t) for t in tokens)
+        root._ordinals.extend(tokens)
+        if normalize is not None:
+            root._normindex.update(zip(normvals, range(base, base + len(tokens))))
+            root._normcache.clear()
+        update = root._fingerprinter.update
+        for token in tokens:
+            update(repr((token.__class__.__qualname__, token._str, token._int)).encode())
+        root._listings.clear()
+        return tokens
+
+    @classmethod
+    def isfrozen(cls):
+        "whether the root of this class is frozen (see `freeze`)"
+        return cls._root._frozen
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._registerhierarchy()
+
+    @classmethod
+    def _registerhierarchy(cls):
+        "adds a newly defined token class to the class hierarchy index"
+        parents = [c for c in cls.__bases__ if issubclass(c, Token)]
+        cls._ancestors = tuple(c for c in cls.__mro__ if issubclass(c, Token))
+        cls._ancestorset = frozenset(cls._ancestors)
+        cls._depth = max((c._depth+1 for c in parents), default=0)
+        # weak references, so that the index does not keep token classes alive
+        cls._descendants = []
+        ref = weakref.ref(cls)
+        for c in cls._ancestors:
+            c._descendants.append(ref)
+
+    @classmethod
+    def _rootmro(cls):
+        "the class and its parent classes up to (and including) its root class"
+        root = cls._root
+        return (c for c in cls._ancestors if root in c._ancestorset)
+
+    @classmethod
+    def _classlistings(cls):
+        "the cached listings of this class (dropped whenever a token is registered below it)"
+        try:
+            return cls._listings[cls]
+        except KeyError:
+            listings = cls._listings[cls] = {}
+            return listings
+
+    @classmethod
+    def _registerclass(cls):
+        "adds a class that has just registered its first token to the sub registers of its parents"
+        subregister = cls._subregister
+        for c in cls._rootmro():
+            subregister.setdefault(c, []).append(cls)
+
     @classmethod
     def byval(cls, tokenvalue, noneIfMissing=False):
         """
@@ -195,13 +651,79 @@ class Token:
         this will raise an error
         """
         index = cls._index
+        if noneIfMissing:
+            return index.get(tokenvalue)
         try:
-            token = index[tokenvalue]
+            return index[tokenvalue]
         except KeyError:
-            if noneIfMissing: return None
             raise KeyError("token with this string value does not exist", tokenvalue)
+
+    @classmethod
+    def bynormalized(cls, tokenvalue, noneIfMissing=False):
+        """
+        retrieve a token by a string value that is equal to its value under normalization
+
+        :tokenvalue:        the (string) value, eg " err-db " for ERR_DB
+        :noneIfMissing:     if True return None upon a missing token instead of raising (default)
+        :returns:           the token instance
+
+        the value is normalized with the function given to `makeroot(normalize=...)` and looked
+        up in the normalized index of the root; the results for the most recent raw values
+        (hits and misses, up to `normalizeCacheSize`) are remembered, so that repeated raw
+        values are not normalized again
+        """
+        root = cls._root
+        normalize = root._normalize
+        if normalize is None:
+            raise RuntimeError("the root of this class has no normalized index (see makeroot)", root)
+        cache = root._normcache
+        token = cache.get(tokenvalue, _MISSING)
+        if token is _MISSING:
+            ordinal = root._normindex.get(normalize(tokenvalue))
+            token = None if ordinal is None else root._ordinals[ordinal]
+            cache[tokenvalue] = token
+            if len(cache) > root._normcachesize:
+                cache.popitem(last=False)
+        if token is None:
+            if noneIfMissing: return None
+            raise KeyError("token with this normalized string value does not exist", tokenvalue)
         return token
 
+    @classmethod
+    def bybytes(cls, bytesvalue, noneIfMissing=False):
+        """
+        retrieve a token by its (globally unique) string token value, given as utf-8 bytes
+
+        :bytesvalue:        the value of the token as bytes, bytearray or memoryview
+        :noneIfMissing:     if True return None upon a missing token instead of raising (default)     
+        :returns:           the token instance
+
+        in roots created with `makeroot(bytesIndex=True)` bytes and read-only memoryviews (eg
+        slices of a received buffer) are looked up in the bytes index of the root directly,
+        without decoding or copying; bytearrays and writable memoryviews are not hashable and
+        are copied to bytes first; other roots decode the value and look it up in the string
+        index; like `byval` this requires `makeroot(globalIndex=True)`
+        """
+        index = cls._bytesindex
+        if index is None:
+            try:
+                token = cls._index.get(str(bytesvalue, "utf-8"))
+            except UnicodeDecodeError:
+                token = None
+            if token is not None: return token
+        else:
+            if bytesvalue.__class__ is bytearray:
+                bytesvalue = bytes(bytesvalue)
+            try:
+                return index[bytesvalue]
+            except KeyError:
+                pass
+            except (TypeError, ValueError):
+                token = index.get(bytes(bytesvalue))
+                if token is not None: return token
+        if noneIfMissing: return None
+        raise KeyError("token with this bytes value does not exist", bytes(bytesvalue))
+
     @classmethod
     def bynum(cls, numvalue, noneIfMissing=False):
         """
@@ -220,13 +742,156 @@ class Token:
         this will raise an error
         """
         index = cls._numindex
+        if noneIfMissing:
+            return index.get(numvalue)
         try:
-            token = index[numvalue]
+            return index[numvalue]
         except KeyError:
-            if noneIfMissing: return None
             raise KeyError("token with this int value does not exist", numvalue)
-        return token
 
+    @classmethod
+    def byprefix(cls, prefix, limit=None):
+        """
+        retrieve the tokens whose string value starts with prefix
+
+        :prefix:            the prefix of the string values (str; "" for all tokens)
+        :limit:             the maximum number of tokens returned (default: None, ie all)
+        :returns:           the list of token instances, in order of their string values
+
+        the string values of the root are kept in sorted arrays (updated as tokens are
+        registered), so that the matching tokens are found by binary searches rather than
+        by scanning all tokens; this requires `makeroot(globalIndex=True, prefixIndex=True)`
+        """
+        prefixindex = cls._prefixindex
+        if prefixindex is None:
+            raise RuntimeError("the root of this class has no prefix index (see makeroot)", cls._root)
+        index = cls._index
+        return [index[strval] for strval in prefixindex.search(prefix, limit)]
+
+    @classmethod
+    def countprefix(cls, prefix):
+        """
+        the number of tokens whose string value starts with prefix (see `byprefix`)
+        """
+        prefixindex = cls._prefixindex
+        if prefixindex is None:
+            raise RuntimeError("the root of this class has no prefix index (see makeroot)", cls._root)
+        return prefixindex.count(prefix)
+
+    @classmethod
+    def byvals(cls, tokenvalues, missing=None, returnMisses=False):
+        """
+        retrieve the tokens for an iterable of (globally unique) string token values
+
+        :tokenvalues:       an iterable of (string) values of the tokens
+        :missing:           the value returned in place of a missing token (default: None)
+        :returnMisses:      if True, also return the indices of the missing tokens
+        :returns:           the list of token instances, or the tuple (tokens, missindices)
+                            if returnMisses is True
+
+        misses never raise; the lookups run as a single `map` over the index, which avoids
+        the method dispatch and try/except per element of calling `byval` in a loop; like
+        `byval` this requires `makeroot(globalIndex=True)`
+        """
+        result = list(map(cls._index.get, tokenvalues, repeat(missing)))
+        if returnMisses:
+            return result, [i for i, token in enumerate(result) if token is missing]
+        return result
+
+    @classmethod
+    def bynums(cls, numvalues, missing=None, returnMisses=False):
+        """
+        retrieve the tokens for an iterable of (globally unique) integer token values
+
+        :numvalues:         an iterable of (int) values of the tokens
+        :missing:           the value returned in place of a missing token (default: None)
+        :returnMisses:      if True, also return the indices of the missing tokens
+        :returns:           the list of token instances, or the tuple (tokens, missindices)
+                            if returnMisses is True
+
+        see `byvals`; like `bynum` this requires `makeroot(globalNumIndex=True)`
+        """
+        result = list(map(cls._numindex.get, numvalues, repeat(missing)))
+        if returnMisses:
+            return result, [i for i, token in enumerate(result) if token is missing]
+        return result
+
+    @classmethod
+    def ordinal(cls, token):
+        """
+        the ordinal of the token within the root of this class
+
+        :token:             the token
+        :returns:           the ordinal of the token (int)
+
+        every token registered under a root (including Token itself) gets a stable and dense
+        ordinal 0..N-1 in order of definition; the same value is returned by `operator.index`,
+        so tokens can index lists and arrays directly (`data[TOKEN]`)
+        """
+        if token._root is not cls._root:
+            raise KeyError("token does not belong to this root", token, cls._root)
+        return token._ordinal
+
+    @classmethod
+    def byordinal(cls, ordinal, noneIfMissing=False):
+        """
+        retrieve a token by its ordinal within the root of this class
+
+        :ordinal:           the ordinal of the token (see `ordinal`)
+        :noneIfMissing:     if True return None upon a missing token instead of raising (default)     
+        :returns:           the token instance
+        """
+        ordinals = cls._ordinals
+        if 0 <= ordinal < len(ordinals):
+            return ordinals[ordinal]
+        if noneIfMissing: return None
+        raise KeyError("token with this ordinal does not exist", ordinal)
+
+    @classmethod
+    def shards(cls, tokens, nshards):
+        """
+        the shards of many tokens of the root of this class (see `shard`)
+
+        :tokens:            an iterable of tokens of the root of this class
+        :nshards:           the number of shards
+        :returns:           the list of shard numbers
+
+        the shards of all tokens of the root are computed once per `nshards` and cached with
+        the listings of the root (for the SHARDTABLES most recent values of `nshards`), so
+        that routing a token is a list lookup by ordinal; store backed roots only compute the
+        shards of the tokens that are routed, so that their tokens are not all materialized
+        """
+        root = cls._root
+        result = []
+        if root._store is not None:
+            shards = {}
+            for token in tokens:
+                if token._root is not root:
+                    raise KeyError("token does not belong to this root", token, root)
+                try:
+                    result.append(shards[token._ordinal])
+                except KeyError:
+                    shard = shards[token._ordinal] = _jumphash(token.stablehash, nshards)
+                    result.append(shard)
+            return result
+        table = root._shardtable(nshards)
+        for token in tokens:
+            if token._root is not root:
+                raise KeyError("token does not belong to this root", token, root)
+            result.append(table[token._ordinal])
+        return result
+
+    @classmethod
+    def _shardtable(cls, nshards):
+        "the shards of all tokens of this root for nshards, indexed by ordinal (cached)"
+        tables = cls._classlistings().setdefault("shards", OrderedDict())
+        try:
+            return tables[nshards]
+        except KeyError:
+            result = tables[nshards] = [_jumphash(t.stablehash, nshards) for t in cls._ordinals]
+            if len(tables) > SHARDTABLES:
+                tables.popitem(last=False)
+            return result
 
     @classmethod
     def includes(cls, token):
@@ -250,13 +915,51 @@ class Token:
     @classmethod 
     def issubtoken(cls, other):
         "whether other is a sub token class of the current class"
-        return issubclass(other, cls)
+        try:
+            return cls in other._ancestorset
+        except AttributeError:
+            return issubclass(other, cls)
 
     @classmethod 
     def isparenttoken(cls, other):
         "whether other is a parent token class of the current class"
+        if other in cls._ancestorset: return True
+        if hasattr(other, "_ancestorset"): return False
         return issubclass(cls, other)
 
+    @classmethod
+    def depth(cls):
+        "the depth of this class in the token class hierarchy (Token has depth 0)"
+        return cls._depth
+
+    @classmethod
+    def parentclasses(cls, namesOnly=True):
+        """
+        this token class and all its parent token classes
+
+        :namesOnly:     if True only returns the class name, otherwise the actual class
+        :returns:       the class and all its token parent classes, in method resolution order
+        """
+        if namesOnly:
+            return tuple(c.__name__ for c in cls._ancestors)
+        return cls._ancestors
+
+    @classmethod
+    def allsubclasses(cls, namesOnly=True):
+        """
+        this token class and all its child token classes, whether or not they have tokens
+
+        :namesOnly:     if True only returns the class name, otherwise the actual class
+        :returns:       the class and all its subclasses, in order of definition; called
+                        on a root class this lists all classes under the root
+        """
+        listing = tuple(c for c in (ref() for ref in cls._descendants) if c is not None)
+        if len(listing) < len(cls._descendants):
+            cls._descendants = [weakref.ref(c) for c in listing]
+        if namesOnly:
+            return tuple(c.__name__ for c in listing)
+        return listing
+
     @classmethod
     def subclasses(cls, namesOnly=True):
         """
@@ -266,28 +969,109 @@ class Token:
         :returns:       the class and all its subclasses THAT HAVE AT LEAST ON TOKEN 
                         INSTANTIATED; if the parent class has no instantiated tokens
                         it will not appear in the register, and therefore not on this list
+                        (see `allsubclasses` for all classes)
+
+        the result is cached and only rebuilt after a new class registered its first token
         """
-        result = ( c for c in cls._register if issubclass(c, cls) or c==cls)
+        listings = cls._classlistings()
+        key = ("classes", namesOnly)
+        try:
+            return listings[key]
+        except KeyError:
+            pass
+        result = cls._subregister.get(cls, ())
         if namesOnly:
             result = (c.__name__ for c in result)
-        return tuple(result)
+        result = listings[key] = tuple(result)
+        return result
 
     @classmethod
-    def tokens(cls, strOnly=True):
+    def tokens(cls, strOnly=True, offset=0, limit=None):
         """
         all tokens in this token class and all its subclasses
 
         :strOnly:       if True only returns the token string, otherwise the actual instance
                         (note that names only have to be unique across a final class, so there
                         can be the same name twice)
+        :offset:        the index of the first token returned (default: 0)
+        :limit:         the maximum number of tokens returned (default: None, ie all)
         :returns:       a tuple of all tokens, in order of definition
+
+        the full listing is cached and only rebuilt after a token has been registered in
+        this class or one of its subclasses, so that repeated calls are O(1); with offset
+        and/or limit only the requested slice is copied; for store backed roots nothing is
+        cached, and with offset and/or limit only the requested tokens are materialized
         """
-        result = (t  for c in cls._register if issubclass(c, cls) or c==cls 
-                                                        for _,t in cls._register[c].items())
-        if strOnly:
-            result = (t.str for t in result)
+        if cls._root._store is not None:
+            return cls._storetokens(strOnly, offset, limit)
+        listings = cls._classlistings()
+        key = ("tokens", strOnly)
+        try:
+            result = listings[key]
+        except KeyError:
+            result = listings[key] = tuple(cls.itertokens(strOnly=strOnly))
+        if offset or limit is not None:
+            result = result[offset:None if limit is None else offset+limit]
+        return result
+
+    @classmethod
+    def _storetokens(cls, strOnly, offset, limit):
+        "the tokens of `tokens` for a store backed root, paged by class (see `tokens`)"
+        if offset < 0 or (limit is not None and limit < 0):
+            return tuple(cls.itertokens(strOnly=strOnly))[offset:None if limit is None else offset+limit]
+        register = cls._register
+        ordinals = cls._root._ordinals
+        result = []
+        for c in cls._subregister.get(cls, ()):
+            if limit is not None and len(result) >= limit: break
+            classregister = register[c]
+            if offset >= len(classregister):
+                offset -= len(classregister)
+                continue
+            count = None if limit is None else limit - len(result)
+            if strOnly:
+                result.extend(classregister.strings(offset, count))
+            else:
+                result.extend(map(ordinals.__getitem__, classregister.ordinals(offset, count)))
+            offset = 0
         return tuple(result)
 
+    @classmethod
+    def _tokenmask(cls):
+        "bitmask over the ordinals of all tokens in this class and all its subclasses (cached)"
+        listings = cls._classlistings()
+        try:
+            return listings["mask"]
+        except KeyError:
+            pass
+        if cls._root._store is not None:
+            register = cls._register
+            ordinals = (o for c in cls._subregister.get(cls, ()) for o in register[c].ordinals())
+        else:
+            ordinals = (t._ordinal for t in cls.itertokens(strOnly=False))
+        mask = listings["mask"] = _bitmask(ordinals)
+        return mask
+
+    @classmethod
+    def itertokens(cls, strOnly=True):
+        """
+        iterates over all tokens in this token class and all its subclasses
+
+        :strOnly:       if True yields only the token string, otherwise the actual instance
+        :returns:       an iterator over all tokens, in order of definition (the same order
+                        as `tokens`); tokens must not be registered while iterating
+        """
+        register = cls._register
+        store = cls._root._store is not None
+        for c in cls._subregister.get(cls, ()):
+            if strOnly:
+                yield from register[c].keys()
+            elif store:
+                # materialize the tokens one at a time rather than the whole class
+                yield from map(cls._root._ordinals.__getitem__, register[c].ordinals())
+            else:
+                yield from register[c].values()
+
     @property
     def type(s):
         "the token type (equals class name)"
@@ -296,55 +1080,999 @@ class Token:
     @property
     def int(s):
         "int value of the token"
-        return s._val.intval
+        return s._int
 
     @property
     def str(s):
         "string value of the token"
-        return s._val.strval
+        return s._str
 
     @property
     def bytes(s):
-        "bytes value of the token"
-        return s._val.strval.encode()
+        """
+        bytes value of the token (the utf-8 encoded string value); kept on the token in roots
+        with a bytes index (see `makeroot`), and encoded on every access otherwise
+        """
+        if s._bytes is not None:
+            return s._bytes
+        return s._str.encode() if isinstance(s._str, str) else None
 
     @property
     def float(s):
         "float value of the token"
-        return s._val.floatval
+        return s._float
         
     @property
     def dict(s):
         "dict value of the token"
-        return s._val.dictval
+        return s._dict
 
     @property
     def list(s):
         "list value of the token"
-        return s._val.listval
+        return s._list
 
     @property
     def tuple(s):
         "alias for list"
-        return s.list()
+        return s._list
+
+    @property
+    def stablehash(s):
+        """
+        64 bit hash of the class path and string value of the token that is the same in
+        every process (unlike `hash(token)`, and `hash(token.str)` under PYTHONHASHSEED);
+        computed on first access
+        """
+        if s._stablehash is None:
+            data = s._str.encode() if isinstance(s._str, str) else repr(s._str).encode()
+            s._stablehash = _stablehash(s.__class__, data)
+        return s._stablehash
+
+    def shard(s, nshards, key=None):
+        """
+        the shard 0..nshards-1 of the token (or of the pair (token, key))
+
+        :nshards:       the number of shards
+        :key:           an int, str or bytes key that is routed together with the token (optional)
+
+        uses jump consistent hashing on `stablehash`, so the result is the same in every
+        process, and when nshards changes from n to n+1 only 1/(n+1) of the tokens (or
+        pairs) move, all of them to the new shard; int keys are used as they are, and the
+        hashes of the KEYHASHCACHESIZE most recent str and bytes keys are cached, so int keys
+        are the fast path; without key the shard table of `shards` is used if it exists, but
+        it is not built for a single token
+        """
+        if key is None:
+            tables = s._root._classlistings().get("shards")
+            if tables is not None and nshards in tables:
+                return tables[nshards][s._ordinal]
+            return _jumphash(s.stablehash, nshards)
+        if key.__class__ is int:
+            keyhash = key & _MASK64
+        else:
+            keyhash = _keyhash(key)
+        return _jumphash(_mix64(s.stablehash ^ keyhash), nshards)
 
     @property
     def val(s):
-        "the entire TokenValue object containing all values"
+        "the entire TokenValue object containing all values (built on first access)"
+        if s._val is None:
+            s._val = s.TokenValue(s._str, s._int, s._float, s._dict, s._list)
         return s._val
 
     def __str__(s):
-        return s.str
+        return s._str
+
+    def __index__(s):
+        return s._ordinal
 
     def __repr__(s):
-        return "{n}(val={v})".format(n=s.__class__.__name__, v=s._val)
+        return "{n}(val={v})".format(n=s.__class__.__name__, v=s.val)
 
     def __eq__(s, other):
-        return s.__class__ == other.__class__ and s.str == other.str and s.int == other.int
+        if s is other: return True
+        return s.__class__ == other.__class__ and s._str == other._str and s._int == other._int
 
     def __ne__(s, other):
+        if s is other: return False
         return not s.__eq__(other)
 
+    # tokens are unique per (class, str) in the register, and they unpickle and copy to the
+    # registered instance, so tokens that are == are the same object and the identity hash
+    # agrees with __eq__; using object.__hash__ directly keeps it a C-level slot, so token
+    # keyed dict lookups cost the same as int keyed ones
+    __hash__ = object.__hash__
+
+    def __reduce__(s):
+        return (_unpickle, (s._root, s.__class__.__qualname__, s._str))
+
+    def __copy__(s):
+        return s
+
+    def __deepcopy__(s, memo):
+        return s
+
+Token._root = Token
+Token._frozen = False
+Token._roots = [Token]
+Token._fingerprinter = hashlib.blake2b(digest_size=16)
+Token._store = None
+Token._registerhierarchy()
+
+def _unpickle(root, qualname, strval):
+    "the registered token of the class `qualname` in `root` with string value `strval` (see Token.__reduce__)"
+    listings = root._classlistings()
+    try:
+        registers = listings["unpickle.registers"]
+    except KeyError:
+        registers = listings["unpickle.registers"] = {c.__qualname__: r for c, r in root._register.items()}
+    try:
+        return registers[qualname][strval]
+    except KeyError:
+        pass
+    raise KeyError("cannot unpickle token that does not exist", root.__qualname__, qualname, strval)
+
+
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+
+_stablehashprefixes = {}
+
+def _stablehash(tokenclass, data):
+    "the 64 bit blake2b hash of data (prefixed by the class path of tokenclass, if given) as int"
+    if tokenclass is None:
+        return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+    # the hash state after the class path is kept per class path, and copied for every token
+    path = (tokenclass.__module__, tokenclass.__qualname__)
+    try:
+        digest = _stablehashprefixes[path].copy()
+    except KeyError:
+        prefix = _stablehashprefixes[path] = hashlib.blake2b(digest_size=8)
+        prefix.update("{}:{}\0".format(*path).encode())
+        digest = prefix.copy()
+    digest.update(data)
+    return int.from_bytes(digest.digest(), "little")
+
+_keyhashes = OrderedDict()
+
+def _keyhash(key):
+    "the stable hash of a str, bytes or int key of `Token.shard` (cached for str and bytes keys)"
+    if isinstance(key, int):
+        return key & _MASK64
+    if not isinstance(key, (str, bytes)):
+        key = bytes(key)
+    try:
+        return _keyhashes[key]
+    except KeyError:
+        pass
+    result = _keyhashes[key] = _stablehash(None, key.encode() if isinstance(key, str) else key)
+    if len(_keyhashes) > KEYHASHCACHESIZE:
+        _keyhashes.popitem(last=False)
+    return result
+
+def _mix64(x):
+    "the splitmix64 finalizer of the 64 bit int x"
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return x ^ (x >> 31)
+
+def _jumphash(key, nbuckets):
+    "the bucket 0..nbuckets-1 of the 64 bit int key (jump consistent hash, Lamping and Veach 2014)"
+    if nbuckets < 1:
+        raise ValueError("the number of shards must be positive", nbuckets)
+    b, j = -1, 0
+    while j < nbuckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & _MASK64
+        j = int((b + 1) * (2147483648.0 / ((key >> 33) + 1)))
+    return b
+
+def _bitmask(ordinals):
+    "the int bitmask with the bits at `ordinals` set, built in O(N) via a bytearray"
+    ordinals = list(ordinals)
+    if not ordinals: return 0
+    buffer = bytearray((max(ordinals) >> 3) + 1)
+    for ordinal in ordinals:
+        buffer[ordinal >> 3] |= 1 << (ordinal & 7)
+    return int.from_bytes(buffer, "little")
+
+class FrozenTokenSet:
+    """
+    immutable and hashable set of tokens of one root, stored as a bitmask over token ordinals
+
+    :tokens:        the tokens in the set (an iterable)
+    :root:          the root class (optional if tokens is not empty; must be the root of all tokens)
+
+    membership is a byte lookup in a bytes copy of the bitmask (made on the first test), and
+    union, intersection and difference are single int operations on the bitmasks; iteration
+    is in ordinal order, ie in order of definition
+
+    EXAMPLE
+
+        STOPPED = FrozenTokenSet((PAUSED, HALTED, EXHAUSTED))
+        if state in STOPPED:
+            ...
+        ERRORS = FrozenTokenSet.of(Error)
+    """
+    __slots__ = ("_root", "_mask", "_hash", "_bits")
+
+    def __init__(s, tokens=(), root=None):
+        tokens = tuple(tokens)
+        if root is None:
+            if not tokens:
+                raise RuntimeError("root must be given for an empty token set")
+            root = tokens[0]._root
+        else:
+            root = root._root
+        for token in tokens:
+            if token._root is not root:
+                raise RuntimeError("all tokens in a token set must belong to the same root", token, root)
+        s._root = root
+        s._mask = _bitmask(t._ordinal for t in tokens)
+        s._hash = None
+        s._bits = None
+
+    @classmethod
+    def of(cls, tokenclass):
+        "the set of all tokens in tokenclass and its subclasses"
+        return cls._frommask(tokenclass._root, tokenclass._tokenmask())
+
+    @classmethod
+    def _frommask(cls, root, mask):
+        result = cls.__new__(cls)
+        result._root = root
+        result._mask = mask
+        result._hash = None
+        result._bits = None
+        return result
+
+    @property
+    def root(s):
+        "the root class of the tokens in this set"
+        return s._root
+
+    @property
+    def mask(s):
+        "the bitmask over the token ordinals"
+        return s._mask
+
+    def _othermask(s, other):
+        "the bitmask of other (a token set of the same root, or an iterable of tokens)"
+        if not isinstance(other, FrozenTokenSet):
+            other = FrozenTokenSet(other, root=s._root)
+        elif other._root is not s._root:
+            raise RuntimeError("token sets must belong to the same root", s._root, other._root)
+        return other._mask
+
+    def _bitmap(s):
+        "the bitmask as a bytearray, so that a membership test does not copy the int (built on first use)"
+        bits = s._bits
+        if bits is None:
+            bits = s._bits = bytearray(s._mask.to_bytes((s._mask.bit_length() + 7) >> 3, "little"))
+        return bits
+
+    def __contains__(s, token):
+        if not isinstance(token, Token) or token._root is not s._root:
+            return False
+        bits = s._bits
+        if bits is None:
+            bits = s._bitmap()
+        ordinal = token._ordinal
+        try:
+            return bits[ordinal >> 3] >> (ordinal & 7) & 1 == 1
+        except IndexError:
+            return False
+
+    def __iter__(s):
+        ordinals = s._root._ordinals
+        bits = bin(s._mask)[:1:-1]
+        ordinal = bits.find("1")
+        while ordinal >= 0:
+            yield ordinals[ordinal]
+            ordinal = bits.find("1", ordinal+1)
+
+    def __len__(s):
+        return bin(s._mask).count("1")
+
+    def __bool__(s):
+        return s._mask != 0
+
+    def __repr__(s):
+        return "{n}({r}: {t})".format(n=s.__class__.__name__, r=s._root.__name__, t=", ".join(t._str for t in s))
+
+    def __eq__(s, other):
+        if isinstance(other, FrozenTokenSet):
+            return s._root is other._root and s._mask == other._mask
+        if isinstance(other, (set, frozenset)):
+            return set(s) == other
+        return NotImplemented
+
+    def __ne__(s, other):
+        result = s.__eq__(other)
+        if result is NotImplemented: return result
+        return not result
+
     def __hash__(s):
-        return hash(s._val)
+        # equal to a frozenset with the same tokens, so it must hash like one (computed once)
+        if s._hash is None:
+            s._hash = hash(frozenset(s))
+        return s._hash
+
+    def union(s, *others):
+        "the set of tokens in this set or any of the others"
+        mask = s._mask
+        for other in others: mask |= s._othermask(other)
+        return s._frommask(s._root, mask)
+
+    def intersection(s, *others):
+        "the set of tokens in this set and all of the others"
+        mask = s._mask
+        for other in others: mask &= s._othermask(other)
+        return s._frommask(s._root, mask)
+
+    def difference(s, *others):
+        "the set of tokens in this set but in none of the others"
+        mask = s._mask
+        for other in others: mask &= ~s._othermask(other)
+        return s._frommask(s._root, mask)
+
+    def symmetric_difference(s, other):
+        "the set of tokens in either this set or other, but not in both"
+        return s._frommask(s._root, s._mask ^ s._othermask(other))
+
+    def issubset(s, other):
+        "whether all tokens in this set are in other"
+        return s._mask & ~s._othermask(other) == 0
+
+    def issuperset(s, other):
+        "whether all tokens in other are in this set"
+        return s._othermask(other) & ~s._mask == 0
+
+    def isdisjoint(s, other):
+        "whether this set and other have no tokens in common"
+        return s._mask & s._othermask(other) == 0
+
+    def copy(s):
+        return s._frommask(s._root, s._mask)
+
+    def _operand(s, other):
+        "the bitmask of other if it is a token set, otherwise None (binary operators return NotImplemented)"
+        if isinstance(other, FrozenTokenSet):
+            return s._othermask(other)
+        return None
+
+    def __or__(s, other):
+        mask = s._operand(other)
+        if mask is None: return NotImplemented
+        return s._frommask(s._root, s._mask | mask)
+
+    def __and__(s, other):
+        mask = s._operand(other)
+        if mask is None: return NotImplemented
+        return s._frommask(s._root, s._mask & mask)
+
+    def __sub__(s, other):
+        mask = s._operand(other)
+        if mask is None: return NotImplemented
+        return s._frommask(s._root, s._mask & ~mask)
+
+    def __xor__(s, other):
+        mask = s._operand(other)
+        if mask is None: return NotImplemented
+        return s._frommask(s._root, s._mask ^ mask)
+
+    def __le__(s, other):
+        mask = s._operand(other)
+        if mask is None: return NotImplemented
+        return s._mask & ~mask == 0
+
+    def __lt__(s, other):
+        mask = s._operand(other)
+        if mask is None: return NotImplemented
+        return s._mask & ~mask == 0 and s._mask != mask
+
+    def __ge__(s, other):
+        mask = s._operand(other)
+        if mask is None: return NotImplemented
+        return mask & ~s._mask == 0
+
+    def __gt__(s, other):
+        mask = s._operand(other)
+        if mask is None: return NotImplemented
+        return mask & ~s._mask == 0 and s._mask != mask
+
+class TokenSet(FrozenTokenSet):
+    """
+    mutable set of tokens of one root, stored as a bitmask over token ordinals
+
+    see FrozenTokenSet; in addition to the operations there it supports the usual in-place
+    set operations; it is not hashable; adding and removing single tokens also updates the
+    bytes copy of the bitmask used for membership tests, the other in-place operations drop it
+    """
+    __slots__ = ()
+    __hash__ = None
+
+    def _flipbit(s, ordinal):
+        "toggle the bit of ordinal in the bitmask (and in its bytes copy, if any)"
+        s._mask ^= 1 << ordinal
+        bits = s._bits
+        if bits is not None:
+            i = ordinal >> 3
+            if i >= len(bits):
+                bits.extend(bytes(i + 1 - len(bits)))
+            bits[i] ^= 1 << (ordinal & 7)
+
+    def add(s, token):
+        "add token to the set"
+        if token._root is not s._root:
+            raise RuntimeError("all tokens in a token set must belong to the same root", token, s._root)
+        if token not in s:
+            s._flipbit(token._ordinal)
+
+    def discard(s, token):
+        "remove token from the set if it is present"
+        if token in s:
+            s._flipbit(token._ordinal)
+
+    def remove(s, token):
+        "remove token from the set; raises KeyError if it is not present"
+        if token not in s:
+            raise KeyError(token)
+        s._flipbit(token._ordinal)
+
+    def pop(s):
+        "remove and return the token with the lowest ordinal; raises KeyError if empty"
+        if not s._mask:
+            raise KeyError("pop from an empty token set")
+        ordinal = (s._mask & -s._mask).bit_length() - 1
+        s._flipbit(ordinal)
+        return s._root._ordinals[ordinal]
+
+    def clear(s):
+        "remove all tokens from the set"
+        s._mask = 0
+        s._bits = None
+
+    def update(s, *others):
+        "add all tokens in the others"
+        for other in others: s._mask |= s._othermask(other)
+        s._bits = None
+
+    def intersection_update(s, *others):
+        "keep only the tokens also in all of the others"
+        for other in others: s._mask &= s._othermask(other)
+        s._bits = None
+
+    def difference_update(s, *others):
+        "remove all tokens in the others"
+        for other in others: s._mask &= ~s._othermask(other)
+        s._bits = None
+
+    def symmetric_difference_update(s, other):
+        "keep the tokens in either this set or other, but not in both"
+        s._mask ^= s._othermask(other)
+        s._bits = None
+
+    def __ior__(s, other):
+        mask = s._operand(other)
+        if mask is None: return NotImplemented
+        s._mask |= mask
+        s._bits = None
+        return s
+
+    def __iand__(s, other):
+        mask = s._operand(other)
+        if mask is None: return NotImplemented
+        s._mask &= mask
+        s._bits = None
+        return s
+
+    def __isub__(s, other):
+        mask = s._operand(other)
+        if mask is None: return NotImplemented
+        s._mask &= ~mask
+        s._bits = None
+        return s
+
+    def __ixor__(s, other):
+        mask = s._operand(other)
+        if mask is None: return NotImplemented
+        s._mask ^= mask
+        s._bits = None
+        return s
+
+_MISSING = object()
+
+class _TokenMapItems(ItemsView):
+    "the items view of a TokenMap (iterates over its value list rather than looking up every key)"
+    __slots__ = ()
+
+    def __iter__(s):
+        m = s._mapping
+        return ((token, value) for token, value in zip(m._root._ordinals, m._values) if value is not _MISSING)
+
+class _TokenMapValues(ValuesView):
+    "the values view of a TokenMap"
+    __slots__ = ()
+
+    def __iter__(s):
+        return (value for value in s._mapping._values if value is not _MISSING)
+
+class TokenMap(MutableMapping):
+    """
+    mapping keyed by the tokens of one root, storing its values in a list indexed by ordinal
+
+    :items:         the initial items, as a mapping or an iterable of (token, value) pairs
+    :root:          the root class (optional if items is not empty; must be the root of all keys)
+
+    it behaves like a dict (iteration is in ordinal order, ie in order of definition, rather
+    than in order of insertion), but lookups are a list access rather than a hash lookup,
+    and an entry costs one list slot
+
+    EXAMPLE
+
+        handlers = TokenMap.fromclass(Status, default_handler)
+        handlers[USER_ERROR] = user_error_handler
+        handlers[state](...)
+    """
+    __slots__ = ("_root", "_values", "_len")
+
+    def __init__(s, items=(), root=None):
+        if isinstance(items, Mapping):
+            items = items.items()
+        items = tuple(items)
+        if root is None:
+            if not items:
+                raise RuntimeError("root must be given for an empty token map")
+            root = items[0][0]._root
+        s._root = root._root
+        s._values = [_MISSING] * len(s._root._ordinals)
+        s._len = 0
+        for token, value in items:
+            s[token] = value
+
+    @classmethod
+    def fromclass(cls, tokenclass, value=None):
+        "the map with all tokens in tokenclass and its subclasses mapped to value"
+        result = cls(root=tokenclass)
+        if tokenclass is result._root:
+            result._values = [value] * len(result._root._ordinals)
+        else:
+            values = result._values
+            for token in tokenclass.itertokens(strOnly=False):
+                values[token._ordinal] = value
+        result._len = len(result._values) - result._values.count(_MISSING)
+        return result
+
+    @property
+    def root(s):
+        "the root class of the keys of this map"
+        return s._root
+
+    def __getitem__(s, token):
+        try:
+            if token._root is s._root:
+                value = s._values[token._ordinal]
+                if value is not _MISSING: return value
+        except (AttributeError, IndexError):
+            pass
+        raise KeyError(token)
+
+    def get(s, token, default=None):
+        try:
+            if token._root is s._root:
+                value = s._values[token._ordinal]
+                if value is not _MISSING: return value
+        except (AttributeError, IndexError):
+            pass
+        return default
+
+    def __contains__(s, token):
+        try:
+            return token._root is s._root and s._values[token._ordinal] is not _MISSING
+        except (AttributeError, IndexError):
+            return False
+
+    def __setitem__(s, token, value):
+        if token._root is not s._root:
+            raise RuntimeError("all keys of a token map must belong to the same root", token, s._root)
+        values, ordinal = s._values, token._ordinal
+        if ordinal >= len(values):
+            values.extend([_MISSING] * (len(s._root._ordinals) - len(values)))
+        if values[ordinal] is _MISSING:
+            s._len += 1
+        values[ordinal] = value
+
+    def __delitem__(s, token):
+        if token not in s:
+            raise KeyError(token)
+        s._values[token._ordinal] = _MISSING
+        s._len -= 1
+
+    def __iter__(s):
+        return (token for token, value in zip(s._root._ordinals, s._values) if value is not _MISSING)
+
+    def __len__(s):
+        return s._len
+
+    def __repr__(s):
+        return "{n}({r}: {{{i}}})".format(n=s.__class__.__name__, r=s._root.__name__, 
+                    i=", ".join("{}: {!r}".format(t._str, v) for t, v in s.items()))
+
+    def items(s):
+        return _TokenMapItems(s)
+
+    def values(s):
+        return _TokenMapValues(s)
+
+    def clear(s):
+        s._values = [_MISSING] * len(s._values)
+        s._len = 0
+
+    def copy(s):
+        result = s.__class__(root=s._root)
+        result._values = list(s._values)
+        result._len = s._len
+        return result
+
+class TokenStore:
+    """
+    base class of read-only backing stores of the tokens of a root (see `Token.usestore`)
+
+    a store holds the tokens of a root in ordinal order as rows (class index, string, int,
+    float), and the token classes as (qualname, parent class index, number of tokens); the
+    class with parent index -1 is the root; subclasses implement the methods below except
+    `classstrings`, `strings`, `ints` and `fingerprint`, which by default are computed from
+    the rows
+    """
+    def __len__(s):
+        "the number of tokens in the store"
+        raise NotImplementedError()
+
+    def classes(s):
+        "the list of token classes as (qualname, parent class index, number of tokens)"
+        raise NotImplementedError()
+
+    def row(s, ordinal):
+        "the row of the token with this ordinal as (class index, string, int, float)"
+        raise NotImplementedError()
+
+    def find(s, strval):
+        "the ordinal of the token with this string value, or None"
+        raise NotImplementedError()
+
+    def findint(s, intval):
+        "the ordinal of the token with this int value, or None"
+        raise NotImplementedError()
+
+    def classordinals(s, classindex, offset=0, limit=None):
+        "the ordinals of the tokens of the class (not its subclasses), in ordinal order, from offset up to limit"
+        raise NotImplementedError()
+
+    def classstrings(s, classindex, offset=0, limit=None):
+        "the string values of the tokens of the class (not its subclasses), in ordinal order, from offset up to limit"
+        return [s.row(ordinal)[1] for ordinal in s.classordinals(classindex, offset, limit)]
+
+    def strings(s):
+        "the string values of all tokens, in ordinal order (an iterable)"
+        return (s.row(ordinal)[1] for ordinal in range(len(s)))
+
+    def ints(s):
+        "the int values of all tokens that have one, in any order (an iterable)"
+        return (intval for intval in (s.row(ordinal)[2] for ordinal in range(len(s))) if intval is not None)
+
+    def fingerprint(s):
+        "the fingerprint of the tokens in the store (see `Token.fingerprint`)"
+        digest = hashlib.blake2b(digest_size=16)
+        qualnames = [c[0] for c in s.classes()]
+        for ordinal in range(len(s)):
+            classindex, strval, intval, _ = s.row(ordinal)
+            digest.update(repr((qualnames[classindex], strval, intval)).encode())
+        return digest.digest()
+
+class _StoreTokens(Sequence):
+    "the tokens of a store backed root, by ordinal, created on first access (`root._ordinals`)"
+    def __init__(s, store, classes, cacheSize=None):
+        s._store = store
+        s._classes = classes
+        s._len = len(store)
+        s._cacheSize = cacheSize
+        if cacheSize is None:
+            s._cache = {}
+        else:
+            s._cache = WeakValueDictionary()
+            s._recent = OrderedDict()
+
+    def __len__(s):
+        return s._len
+
+    def __getitem__(s, ordinal):
+        if isinstance(ordinal, slice):
+            return [s[i] for i in range(*ordinal.indices(s._len))]
+        if ordinal < 0:
+            ordinal += s._len
+        if not 0 <= ordinal < s._len:
+            raise IndexError("token ordinal out of range", ordinal)
+        try:
+            token = s._cache[ordinal]
+        except KeyError:
+            classindex, strval, intval, floatval = s._store.row(ordinal)
+            token = s._cache[ordinal] = s._classes[classindex]._create(ordinal, strval, intval, floatval)
+        if s._cacheSize is not None:
+            recent = s._recent
+            recent[ordinal] = token
+            recent.move_to_end(ordinal)
+            if len(recent) > s._cacheSize:
+                recent.popitem(last=False)
+        return token
+
+    def __iter__(s):
+        return map(s.__getitem__, range(s._len))
+
+class _StoreIndex(Mapping):
+    "string value -> token of a store backed root (`root._index`)"
+    def __init__(s, store, tokens):
+        s._store = store
+        s._tokens = tokens
+        s._hits = {} if tokens._cacheSize is None else WeakValueDictionary()
+        s._filter = None
+
+    def __getitem__(s, strval):
+        token = s.get(strval)
+        if token is None:
+            raise KeyError(strval)
+        return token
+
+    def get(s, strval, default=None):
+        token = s._hits.get(strval)
+        if token is None:
+            if s._filter is not None and strval not in s._filter:
+                return default
+            ordinal = s._store.find(strval)
+            if ordinal is None:
+                return default
+            token = s._hits[strval] = s._tokens[ordinal]
+        return token
+
+    def __contains__(s, strval):
+        if s._filter is not None and strval not in s._filter:
+            return False
+        return s._store.find(strval) is not None
+
+    def __iter__(s):
+        return iter(s._store.strings())
+
+    def __len__(s):
+        return len(s._store)
+
+class _StoreBytesIndex(Mapping):
+    "utf-8 bytes value -> token of a store backed root (`root._bytesindex`)"
+    def __init__(s, index):
+        s._index = index
+
+    def __getitem__(s, bytesvalue):
+        try:
+            strval = bytes(bytesvalue).decode()
+        except UnicodeDecodeError:
+            raise KeyError(bytesvalue)
+        return s._index[strval]
+
+    def __iter__(s):
+        return (strval.encode() for strval in s._index)
+
+    def __len__(s):
+        return len(s._index)
+
+class _StoreNumIndex(Mapping):
+    "int value -> token of a store backed root (`root._numindex`)"
+    def __init__(s, store, tokens):
+        s._store = store
+        s._tokens = tokens
+        s._hits = {} if tokens._cacheSize is None else WeakValueDictionary()
+        s._filter = None
+
+    def __getitem__(s, intval):
+        token = s.get(intval)
+        if token is None:
+            raise KeyError(intval)
+        return token
+
+    def get(s, intval, default=None):
+        token = s._hits.get(intval)
+        if token is None:
+            if s._filter is not None and intval not in s._filter:
+                return default
+            ordinal = s._store.findint(intval)
+            if ordinal is None:
+                return default
+            token = s._hits[intval] = s._tokens[ordinal]
+        return token
+
+    def __contains__(s, intval):
+        if s._filter is not None and intval not in s._filter:
+            return False
+        return s._store.findint(intval) is not None
+
+    def __iter__(s):
+        row = s._store.row
+        return (intval for intval in (row(i)[2] for i in range(len(s._store))) if intval is not None)
+
+    def __len__(s):
+        return sum(1 for _ in s)
+
+class _StoreClassRegister(Mapping):
+    "string value -> token of one class of a store backed root (`root._register[tokenclass]`)"
+    def __init__(s, store, tokens, classindex, count):
+        s._store = store
+        s._tokens = tokens
+        s._classindex = classindex
+        s._count = count
+
+    def ordinals(s, offset=0, limit=None):
+        "the ordinals of the tokens of the class (from offset, up to limit)"
+        return s._store.classordinals(s._classindex, offset, limit)
 
+    def strings(s, offset=0, limit=None):
+        "the string values of the tokens of the class, in ordinal order (from offset, up to limit)"
+        return s._store.classstrings(s._classindex, offset, limit)
+
+    def __getitem__(s, strval):
+        ordinal = s._store.find(strval)
+        if ordinal is None or s._store.row(ordinal)[0] != s._classindex:
+            raise KeyError(strval)
+        return s._tokens[ordinal]
+
+    def __iter__(s):
+        return iter(s._store.classstrings(s._classindex))
+
+    def __len__(s):
+        return s._count
+
+    def values(s):
+        return [s._tokens[i] for i in s.ordinals()]
+
+    def items(s):
+        return [(token._str, token) for token in s.values()]
+
+class _PrefixIndex:
+    """
+    the sorted string values of a root (`root._prefixindex`, see `Token.byprefix`)
+
+    values are kept in two sorted lists: the bulk of them, and those registered recently;
+    registering appends to the recent values, which are sorted on the next search and only
+    merged into the bulk once they exceed 1/64 of it, so that registering a token is O(1),
+    a search after registrations does not touch the bulk, and merging is O(1) amortized
+    """
+    __slots__ = ("_keys", "_recent", "_sorted")
+
+    def __init__(s, strings=()):
+        s._keys = sorted(strval for strval in strings if isinstance(strval, str))
+        s._recent = []
+        s._sorted = True
+
+    def add(s, strval):
+        "add a string value (values that are not str are ignored)"
+        if isinstance(strval, str):
+            s._recent.append(strval)
+            s._sorted = False
+
+    def update(s, strings):
+        "add all string values"
+        s._recent.extend(strval for strval in strings if isinstance(strval, str))
+        s._sorted = False
+
+    def _lists(s):
+        "the sorted lists (bulk, recent)"
+        if not s._sorted:
+            if len(s._recent) > max(1024, len(s._keys) >> 6):
+                s.compact()
+            else:
+                s._recent.sort()
+            s._sorted = True
+        return s._keys, s._recent
+
+    def compact(s):
+        "merge the recent values into the bulk"
+        if s._recent:
+            s._keys.extend(s._recent)
+            s._keys.sort()
+            s._recent = []
+        s._sorted = True
+
+    @staticmethod
+    def _upper(prefix):
+        """
+        the smallest string greater than all strings starting with prefix (the prefix with its
+        last character incremented, dropping trailing characters that cannot be), or None
+        """
+        if not isinstance(prefix, str):
+            raise TypeError("prefix must be a str", prefix)
+        upper = prefix.rstrip(chr(sys.maxunicode))
+        if not upper:
+            return None
+        return upper[:-1] + chr(ord(upper[-1]) + 1)
+
+    def _slices(s, prefix):
+        "the slices (keys, start, stop) of the sorted lists that start with prefix"
+        upper = s._upper(prefix)
+        for keys in s._lists():
+            start = bisect_left(keys, prefix)
+            yield keys, start, len(keys) if upper is None else bisect_left(keys, upper, start)
+
+    def count(s, prefix):
+        "the number of values that start with prefix"
+        return sum(stop - start for _, start, stop in s._slices(prefix))
+
+    def search(s, prefix, limit=None):
+        "the sorted list of the values that start with prefix (at most limit of them)"
+        parts = [keys[start:stop if limit is None else min(stop, start + limit)]
+                    for keys, start, stop in s._slices(prefix)]
+        bulk, recent = parts
+        if not recent:
+            return bulk
+        return list(merge(bulk, recent))[:limit]
+
+    def __len__(s):
+        return len(s._keys) + len(s._recent)
+
+class _BloomFilter:
+    """
+    Bloom filter of hashable values, sized for `capacity` values at `falsePositiveRate`
+
+    `value in filter` is False if the value has definitely not been added, and True if it
+    probably has; the k bit positions of a value are derived from its Python hash (double
+    hashing), so a filter is only valid within the process that built it; a miss usually
+    stops at the first or second probe
+    """
+    __slots__ = ("_bits", "_nbits", "_rounds", "_count", "capacity", "falsePositiveRate")
+
+    def __init__(s, capacity, falsePositiveRate=0.01):
+        if not 0 < falsePositiveRate < 1:
+            raise ValueError("the false positive rate must be between 0 and 1", falsePositiveRate)
+        capacity = max(1, capacity)
+        nbits = math.ceil(-capacity * math.log(falsePositiveRate) / math.log(2) ** 2)
+        s._bits = bytearray((nbits + 7) // 8)
+        s._nbits = 8 * len(s._bits)
+        s._rounds = range(max(1, round(s._nbits / capacity * math.log(2))))
+        s._count = 0
+        s.capacity = capacity
+        s.falsePositiveRate = falsePositiveRate
+
+    def add(s, value):
+        "add the value to the filter"
+        h = (hash(value) * 0x9E3779B97F4A7C15) & _MASK64
+        bits, nbits = s._bits, s._nbits
+        i, step = h % nbits, (h >> 32) % nbits | 1
+        for _ in s._rounds:
+            bits[i >> 3] |= 1 << (i & 7)
+            i = (i + step) % nbits
+        s._count += 1
+
+    def update(s, values):
+        "add all values to the filter"
+        for value in values:
+            s.add(value)
+
+    def __contains__(s, value):
+        h = (hash(value) * 0x9E3779B97F4A7C15) & _MASK64
+        bits, nbits = s._bits, s._nbits
+        i, step = h % nbits, (h >> 32) % nbits | 1
+        for _ in s._rounds:
+            if not bits[i >> 3] >> (i & 7) & 1:
+                return False
+            i = (i + step) % nbits
+        return True
+
+    def __len__(s):
+        "the number of values added"
+        return s._count
+
+    @property
+    def nhashes(s):
+        "the number of bit positions per value"
+        return len(s._rounds)
+
+    @property
+    def nbytes(s):
+        "the size of the bit array in bytes"
+        return len(s._bits)
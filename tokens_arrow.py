@@ -0,0 +1,122 @@
+"""
+Apache Arrow interop for columns of tokens (optional, requires pyarrow)
+
+    from tokens_arrow import encode, decode
+
+    column = encode(events)             # DictionaryArray: ordinals into the token strings
+    events = decode(column, Status)     # list of tokens (None for nulls)
+
+a token column is a DictionaryArray whose dictionary holds the string values of all tokens of
+a makeroot() root in ordinal order, so that its indices are the token ordinals; the dictionary
+is built once per root and cached with its listings; decoding a dictionary column received
+from elsewhere looks up its dictionary with a single `byvals` call, and then maps the indices
+to tokens, rather than calling `byval` once per row
+
+(c) Stefan LOESCH, topaze.blue 2020.
+
+Licensed under the MIT license https://opensource.org/licenses/MIT
+"""
+import pyarrow as pa
+import pyarrow.compute as pc
+
+def dictionary(root):
+    """
+    the string values of all tokens of root in ordinal order, as an arrow string array
+
+    :root:          the root class (or any class under it)
+    :returns:       the (cached) arrow dictionary of root
+    """
+    root = root._root
+    listings = root._classlistings()
+    try:
+        return listings["arrow.dictionary"]
+    except KeyError:
+        result = listings["arrow.dictionary"] = pa.array([t._str for t in root._ordinals], type=pa.string())
+        return result
+
+def fromordinals(ordinals, root, mask=None):
+    """
+    the dictionary array of root with the given ordinals as indices
+
+    :ordinals:      array-like of ordinals (an int32 NumPy array or arrow array is used without copying)
+    :root:          the root class (or any class under it)
+    :mask:          boolean array-like, True for null entries (optional)
+    :returns:       the DictionaryArray
+    """
+    if not isinstance(ordinals, pa.Array):
+        ordinals = pa.array(ordinals, type=pa.int32(), mask=mask)
+    return pa.DictionaryArray.from_arrays(ordinals, dictionary(root))
+
+def encode(tokens, root=None):
+    """
+    encode a sequence of tokens as a dictionary array
+
+    :tokens:        an iterable of tokens of the same root (None becomes null)
+    :root:          the root class (optional; defaults to the root of the first token)
+    :returns:       the DictionaryArray (indices are the token ordinals)
+    """
+    tokens = list(tokens)
+    if root is None:
+        first = next((t for t in tokens if t is not None), None)
+        if first is None:
+            raise RuntimeError("root must be given if there are no tokens")
+        root = first
+    root = root._root
+    for token in set(tokens):
+        if token is not None and token._root is not root:
+            raise RuntimeError("all tokens must belong to the same root", token, root)
+    ordinals = pa.array([None if t is None else t._ordinal for t in tokens], type=pa.int32())
+    return fromordinals(ordinals, root)
+
+def _lookup(dictionaryarray, root):
+    "the ordinals of root for the dictionary of dictionaryarray (null for unknown strings)"
+    values = dictionaryarray.dictionary
+    if values.equals(dictionary(root)):
+        return None
+    return pa.array([None if t is None else t._ordinal for t in root.byvals(values.to_pylist())], type=pa.int32())
+
+def toordinals(array, root):
+    """
+    the ordinals of the tokens in a dictionary (or string) array
+
+    :array:         an arrow DictionaryArray with string dictionary, a string array, or a
+                    ChunkedArray of either
+    :root:          the root class (or any class under it)
+    :returns:       the Int32Array (or ChunkedArray) of ordinals, null for nulls and for
+                    strings that are not tokens of root
+
+    the dictionary is looked up with a single `byvals` call per chunk; if the dictionary is
+    the one of root (eg because it was created by `encode`) the indices are used as they are
+    """
+    root = root._root
+    if isinstance(array, pa.ChunkedArray):
+        return pa.chunked_array([toordinals(chunk, root) for chunk in array.chunks], type=pa.int32())
+    if not pa.types.is_dictionary(array.type):
+        array = array.dictionary_encode()
+    lookup = _lookup(array, root)
+    indices = array.indices.cast(pa.int32())
+    if lookup is None:
+        return indices
+    return pc.take(lookup, indices)
+
+def decode(array, root, missing=None):
+    """
+    decode a dictionary (or string) array into a list of tokens
+
+    :array:         see `toordinals`
+    :root:          the root class (or any class under it)
+    :missing:       the value returned for nulls and strings that are not tokens (default: None)
+    :returns:       the list of tokens
+    """
+    root = root._root
+    if isinstance(array, pa.ChunkedArray):
+        return [token for chunk in array.chunks for token in decode(chunk, root, missing)]
+    if not pa.types.is_dictionary(array.type):
+        array = array.dictionary_encode()
+    values = array.dictionary
+    if values.equals(dictionary(root)):
+        table = list(root._ordinals)
+    else:
+        table = [missing if t is None else t for t in root.byvals(values.to_pylist())]
+    table.append(missing)
+    return list(map(table.__getitem__, array.indices.fill_null(len(values)).to_pylist()))
@@ -0,0 +1,497 @@
+"""
+compact binary stream codec for sequences of tokens of one makeroot() root
+
+    from tokens_codec import Encoder, Decoder
+
+    with open("states.bin", "wb") as f, Encoder(f, QueueState) as encoder:
+        for state in states:
+            encoder.write(state)
+
+    with open("states.bin", "rb") as f:
+        for state in Decoder(f, QueueState):
+            ...
+
+a stream consists of a header and a body; the header holds a magic number, the format
+version, the name of the root ("<module>:<qualname>") and the fingerprint of its registry;
+the body holds the token ordinals as unsigned LEB128 varints, so that tokens of roots with
+up to 128 tokens take a single byte each; a decoder checks the root name and fingerprint
+of the header against its own root, so that a producer and a consumer with different token
+definitions fail loudly rather than decode garbage
+
+for repetitive streams (eg state logs where the same token repeats thousands of times)
+RunEncoder and RunDecoder store runs of the same token instead, optionally with integer
+timestamps (a run then also requires equally spaced timestamps); the runs are grouped in
+blocks, and a sparse block index at the end of the stream allows random access, and
+counts per token or token class are computed on the runs without expanding them
+
+    with open("states.rle", "wb") as f, RunEncoder(f, QueueState, timestamps=True) as encoder:
+        for timestamp, state in log:
+            encoder.write(state, timestamp)
+
+    with open("states.rle", "rb") as f:
+        decoder = RunDecoder(f, QueueState)
+        decoder.count(Error), decoder[123456]
+        for state, timestamp in decoder:
+            ...
+
+(c) Stefan LOESCH, topaze.blue 2020.
+
+Licensed under the MIT license https://opensource.org/licenses/MIT
+"""
+import io
+from bisect import bisect_right
+from itertools import repeat
+from operator import attrgetter
+
+from tokens import Token, FrozenTokenSet, TokenMap
+
+MAGIC = b"TOKS"
+MAGIC_RUNS = b"TOKR"
+MAGIC_INDEX = b"TOKI"
+VERSION = 1
+BLOCKSIZE = 1024
+BUFSIZE = 64 * 1024
+
+_getordinal = attrgetter("_ordinal")
+
+def rootname(root):
+    "the name of the root class used in stream headers (see `Token.rootname`)"
+    return root.rootname()
+
+def fingerprint(root):
+    "the fingerprint of the token definitions of root (see `Token.fingerprint`)"
+    return root._root.fingerprint()
+
+def _varint(value):
+    "the unsigned LEB128 encoding of value"
+    result = bytearray()
+    while value >= 0x80:
+        result.append((value & 0x7f) | 0x80)
+        value >>= 7
+    result.append(value)
+    return result
+
+def _varints(ordinals):
+    "the varint encodings of the distinct ordinals of a batch, keyed by ordinal"
+    return {ordinal: bytes(_varint(ordinal)) for ordinal in set(ordinals)}
+
+def _zigzag(value):
+    "value mapped to an unsigned int (0, -1, 1, -2, ... -> 0, 1, 2, 3, ...)"
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+def _unzigzag(value):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+def _readvarints(file, bufsize=BUFSIZE):
+    "iterates over the varints in file (read in bulk via readinto)"
+    buffer = bytearray(bufsize)
+    value, shift = 0, 0
+    while True:
+        n = file.readinto(buffer)
+        if not n: break
+        for byte in (buffer if n == len(buffer) else buffer[:n]):
+            if byte & 0x80:
+                value |= (byte & 0x7f) << shift
+                shift += 7
+            else:
+                yield value | (byte << shift)
+                value, shift = 0, 0
+    if shift:
+        raise RuntimeError("token stream is truncated")
+
+def _writeheader(file, root, magic=MAGIC):
+    name = rootname(root).encode()
+    file.write(magic + bytes((VERSION,)) + _varint(len(name)) + name + fingerprint(root))
+
+def _readexactly(file, n):
+    data = file.read(n)
+    if len(data) != n:
+        raise RuntimeError("token stream header is truncated")
+    return data
+
+def _readvarint(file):
+    "a single varint read from file (byte by byte, so nothing is read beyond it)"
+    value, shift = 0, 0
+    while True:
+        byte = _readexactly(file, 1)[0]
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80: return value
+
+def _readheader(file, root, magic=MAGIC):
+    if _readexactly(file, len(magic)) != magic:
+        raise RuntimeError("not a token stream (bad magic number)")
+    version = _readexactly(file, 1)[0]
+    if version != VERSION:
+        raise RuntimeError("unsupported token stream version", version)
+    name = _readexactly(file, _readvarint(file)).decode()
+    if name != rootname(root):
+        raise RuntimeError("token stream is for a different root", name, rootname(root))
+    if _readexactly(file, 16) != fingerprint(root):
+        raise RuntimeError("token stream was written with different token definitions", name)
+
+class Encoder:
+    """
+    writes tokens of one root to a binary file-like object (see module docstring)
+
+    :file:          the file-like object, opened for binary writing
+    :root:          the root class (or any class under it)
+    :bufsize:       the number of bytes buffered before they are written to file
+
+    the header is written on creation; `close` (or leaving the with block) flushes the
+    buffer but does not close file
+    """
+    def __init__(s, file, root, bufsize=BUFSIZE):
+        s._file = file
+        s._root = root._root
+        s._bufsize = bufsize
+        s._buffer = bytearray()
+        _writeheader(file, s._root)
+
+    def write(s, token):
+        "write a single token"
+        if token._root is not s._root:
+            raise RuntimeError("token does not belong to the root of this encoder", token, s._root)
+        ordinal = token._ordinal
+        if ordinal < 0x80:
+            s._buffer.append(ordinal)
+        else:
+            s._buffer += _varint(ordinal)
+        if len(s._buffer) >= s._bufsize:
+            s.flush()
+
+    def writemany(s, tokens):
+        "write all tokens of an iterable"
+        tokens = tokens if isinstance(tokens, (list, tuple)) else list(tokens)
+        root = s._root
+        for token in set(tokens):
+            if token._root is not root:
+                raise RuntimeError("token does not belong to the root of this encoder", token, root)
+        ordinals = list(map(_getordinal, tokens))
+        if not ordinals or max(ordinals) < 0x80:
+            # all ordinals are single byte varints
+            s._buffer += bytes(ordinals)
+        else:
+            s._buffer += b"".join(map(_varints(ordinals).__getitem__, ordinals))
+        if len(s._buffer) >= s._bufsize:
+            s.flush()
+
+    def flush(s):
+        "write the buffered bytes to file"
+        if s._buffer:
+            s._file.write(s._buffer)
+            s._buffer = bytearray()
+
+    def close(s):
+        s.flush()
+
+    def __enter__(s):
+        return s
+
+    def __exit__(s, *exc):
+        s.close()
+
+class Decoder:
+    """
+    reads tokens of one root from a binary file-like object (see module docstring)
+
+    :file:          the file-like object, opened for binary reading (must support readinto)
+    :root:          the root class (or any class under it)
+    :bufsize:       the number of bytes read from file at a time
+
+    the header is read and checked on creation, raising a RuntimeError if it does not match
+    the root; iterating over the decoder yields the tokens
+    """
+    def __init__(s, file, root, bufsize=BUFSIZE):
+        s._file = file
+        s._root = root._root
+        s._bufsize = bufsize
+        _readheader(file, s._root)
+
+    def __iter__(s):
+        ordinals = s._root._ordinals
+        buffer = bytearray(s._bufsize)
+        value, shift = 0, 0
+        while True:
+            n = s._file.readinto(buffer)
+            if not n: break
+            chunk = buffer if n == len(buffer) else buffer[:n]
+            if not shift and chunk.isascii():
+                # all ordinals in this chunk are single bytes
+                yield from map(ordinals.__getitem__, chunk)
+                continue
+            for byte in chunk:
+                if byte & 0x80:
+                    value |= (byte & 0x7f) << shift
+                    shift += 7
+                else:
+                    yield ordinals[value | (byte << shift)]
+                    value, shift = 0, 0
+        if shift:
+            raise RuntimeError("token stream is truncated")
+
+def encode(tokens, root):
+    "the token stream (header and body) for tokens as bytes"
+    file = io.BytesIO()
+    with Encoder(file, root) as encoder:
+        encoder.writemany(tokens)
+    return file.getvalue()
+
+def decode(data, root):
+    "the list of tokens in the token stream data (bytes)"
+    return list(Decoder(io.BytesIO(data), root))
+
+class RunEncoder:
+    """
+    writes tokens of one root to a binary file-like object as runs (see module docstring)
+
+    :file:          the file-like object, opened for binary writing
+    :root:          the root class (or any class under it)
+    :timestamps:    if True, every token is written with an integer timestamp
+    :blocksize:     the number of runs per block of the block index
+    :bufsize:       the number of bytes buffered before they are written to file
+
+    a run is written as varint(ordinal+1), varint(count), and with timestamps the zigzag
+    varints of the difference of its start timestamp to that of the previous run (0 for the
+    first run), and of the step between its timestamps; the body ends with a 0 byte, followed
+    by the block index (number of elements, and per block its first element, its byte offset
+    in the body and the start timestamp of the run before it), the 8 byte offset of the index
+    and MAGIC_INDEX;
+    `close` (or leaving the with block) must be called to write the last run and the index
+    """
+    def __init__(s, file, root, timestamps=False, blocksize=BLOCKSIZE, bufsize=BUFSIZE):
+        s._file = file
+        s._root = root._root
+        s._timestamps = timestamps
+        s._blocksize = blocksize
+        s._bufsize = bufsize
+        s._buffer = bytearray()
+        s._offset = 0               # bytes in the body so far
+        s._elements = 0             # elements in all runs written so far
+        s._index = []               # (first element, byte offset, base timestamp) per block
+        s._runsinblock = 0
+        s._previous = 0             # start timestamp of the previous run
+        s._ordinal = None           # ordinal, count, start timestamp, step and last timestamp
+        s._count = 0                # of the current run
+        s._start = s._step = s._last = None
+        _writeheader(file, s._root, MAGIC_RUNS)
+        file.write(bytes((1 if timestamps else 0,)) + _varint(blocksize))
+
+    def write(s, token, timestamp=None):
+        "write a single token (with its timestamp if the encoder has timestamps)"
+        if token._root is not s._root:
+            raise RuntimeError("token does not belong to the root of this encoder", token, s._root)
+        ordinal = token._ordinal
+        if s._timestamps:
+            if timestamp is None:
+                raise RuntimeError("this encoder requires a timestamp for every token", token)
+            if ordinal == s._ordinal:
+                if s._count == 1:
+                    s._step = timestamp - s._last
+                if timestamp - s._last == s._step:
+                    s._count += 1
+                    s._last = timestamp
+                    return
+            s._flushrun()
+            s._ordinal, s._count, s._start, s._step, s._last = ordinal, 1, timestamp, 0, timestamp
+        else:
+            if ordinal == s._ordinal:
+                s._count += 1
+                return
+            s._flushrun()
+            s._ordinal, s._count = ordinal, 1
+
+    def writemany(s, tokens, timestamps=None):
+        "write all tokens of an iterable (and the corresponding timestamps)"
+        if timestamps is None:
+            for token in tokens: s.write(token)
+        else:
+            for token, timestamp in zip(tokens, timestamps): s.write(token, timestamp)
+
+    def _flushrun(s):
+        "append the current run (if any) to the buffer"
+        if not s._count: return
+        if not s._index or s._runsinblock == s._blocksize:
+            s._index.append((s._elements, s._offset, s._previous))
+            s._runsinblock = 0
+        record = _varint(s._ordinal + 1) + _varint(s._count)
+        if s._timestamps:
+            record += _varint(_zigzag(s._start - s._previous)) + _varint(_zigzag(s._step))
+            s._previous = s._start
+        s._buffer += record
+        s._offset += len(record)
+        s._elements += s._count
+        s._runsinblock += 1
+        s._count = 0
+        if len(s._buffer) >= s._bufsize:
+            s.flush()
+
+    def flush(s):
+        "write the buffered bytes (of complete runs) to file"
+        if s._buffer:
+            s._file.write(s._buffer)
+            s._buffer = bytearray()
+
+    def close(s):
+        "write the last run, the end of the body and the block index"
+        s._flushrun()
+        s._ordinal = None
+        s._buffer.append(0)
+        indexoffset = s._offset + 1
+        index = _varint(s._elements) + _varint(len(s._index))
+        previous = (0, 0)
+        for element, offset, base in s._index:
+            index += _varint(element - previous[0]) + _varint(offset - previous[1])
+            if s._timestamps:
+                index += _varint(_zigzag(base))
+            previous = (element, offset)
+        s._buffer += index + indexoffset.to_bytes(8, "little") + MAGIC_INDEX
+        s.flush()
+
+    def __enter__(s):
+        return s
+
+    def __exit__(s, *exc):
+        s.close()
+
+class RunDecoder:
+    """
+    reads tokens of one root written by RunEncoder from a binary file-like object
+
+    :file:          the file-like object, opened for binary reading (must support readinto;
+                    random access and `len` also require seek, and without seek the stream
+                    can be read only once)
+    :root:          the root class (or any class under it)
+
+    the header is read and checked on creation, raising a RuntimeError if it does not match
+    the root; iterating over the decoder yields the tokens, or (token, timestamp) tuples if
+    the stream has timestamps; `runs` yields the runs themselves, and `counts` and `count`
+    are computed on the runs
+    """
+    def __init__(s, file, root, bufsize=BUFSIZE):
+        s._file = file
+        s._root = root._root
+        s._bufsize = bufsize
+        _readheader(file, s._root, MAGIC_RUNS)
+        s._timestamps = _readexactly(file, 1)[0] == 1
+        s._blocksize = _readvarint(file)
+        s._body = file.tell() if file.seekable() else None
+        s._index = None
+        s._elements = None
+
+    @property
+    def timestamps(s):
+        "whether the stream has timestamps"
+        return s._timestamps
+
+    def _runs(s, offset=0, base=0):
+        "iterates over (ordinal, count, start, step) from offset in the body to its end"
+        if s._body is not None:
+            s._file.seek(s._body + offset)
+        varints = _readvarints(s._file, s._bufsize)
+        previous = base
+        for ordinal in varints:
+            if not ordinal: return
+            count = next(varints)
+            if s._timestamps:
+                start = previous + _unzigzag(next(varints))
+                step = _unzigzag(next(varints))
+                previous = start
+                yield ordinal - 1, count, start, step
+            else:
+                yield ordinal - 1, count, None, None
+        raise RuntimeError("token stream is truncated")
+
+    def runs(s):
+        "iterates over the runs, as (token, count) or (token, count, start timestamp, step) tuples"
+        ordinals = s._root._ordinals
+        for ordinal, count, start, step in s._runs():
+            if s._timestamps:
+                yield ordinals[ordinal], count, start, step
+            else:
+                yield ordinals[ordinal], count
+
+    def __iter__(s):
+        ordinals = s._root._ordinals
+        for ordinal, count, start, step in s._runs():
+            token = ordinals[ordinal]
+            if s._timestamps:
+                for i in range(count): yield token, start + i * step
+            else:
+                yield from repeat(token, count)
+
+    def counts(s):
+        "the number of occurrences of every token, as a TokenMap (computed on the runs)"
+        counts = [0] * len(s._root._ordinals)
+        for ordinal, count, _, _ in s._runs():
+            counts[ordinal] += count
+        result = TokenMap(root=s._root)
+        for token, count in zip(s._root._ordinals, counts):
+            if count: result[token] = count
+        return result
+
+    def count(s, tokens, counts=None):
+        """
+        the number of occurrences of tokens (a token, a token class or a FrozenTokenSet)
+
+        :counts:    the result of `counts` (optional; if not given the stream is read)
+        """
+        if counts is None:
+            counts = s.counts()
+        if isinstance(tokens, Token):
+            return counts.get(tokens, 0)
+        if not isinstance(tokens, FrozenTokenSet):
+            tokens = FrozenTokenSet.of(tokens)
+        return sum(count for token, count in counts.items() if token in tokens)
+
+    def _loadindex(s):
+        "reads the block index at the end of the stream (requires a seekable file)"
+        if s._index is not None: return
+        if s._body is None:
+            raise RuntimeError("random access requires a seekable file")
+        file = s._file
+        file.seek(-12, io.SEEK_END)
+        trailer = _readexactly(file, 12)
+        if trailer[8:] != MAGIC_INDEX:
+            raise RuntimeError("token stream has no block index (was the encoder closed?)")
+        file.seek(s._body + int.from_bytes(trailer[:8], "little"))
+        varints = _readvarints(io.BytesIO(file.read()[:-12]))
+        s._elements = next(varints)
+        index, element, offset = [], 0, 0
+        for _ in range(next(varints)):
+            element += next(varints)
+            offset += next(varints)
+            base = _unzigzag(next(varints)) if s._timestamps else 0
+            index.append((element, offset, base))
+        s._index = index
+
+    def __len__(s):
+        if s._body is None:
+            raise TypeError("len() of a token stream requires a seekable file")
+        s._loadindex()
+        return s._elements
+
+    def __getitem__(s, i):
+        "the token (or (token, timestamp)) at position i, read from the block that contains it"
+        s._loadindex()
+        if i < 0: i += s._elements
+        if not 0 <= i < s._elements:
+            raise IndexError("token stream index out of range", i)
+        block = bisect_right(s._index, (i, float("inf"))) - 1
+        element, offset, base = s._index[block]
+        for ordinal, count, start, step in s._runs(offset, base):
+            if i < element + count:
+                token = s._root._ordinals[ordinal]
+                return (token, start + (i - element) * step) if s._timestamps else token
+            element += count
+
+def encoderuns(tokens, root, timestamps=None):
+    "the run encoded token stream for tokens (and timestamps, if given) as bytes"
+    file = io.BytesIO()
+    with RunEncoder(file, root, timestamps=timestamps is not None) as encoder:
+        encoder.writemany(tokens, timestamps)
+    return file.getvalue()
+
+def decoderuns(data, root):
+    "the list of tokens (or (token, timestamp) tuples) in the run encoded token stream data"
+    return list(RunDecoder(io.BytesIO(data), root))
@@ -0,0 +1,184 @@
+"""
+generates a Python module with token definitions from a declarative spec (JSON, TOML or CSV)
+
+    python tokens_codegen.py status.json status_tokens.py
+
+    from tokens_codegen import generate
+    generate("status.csv", "status_tokens.py")
+
+a spec is a list of tokens, each with the fields `class`, `name`, and optionally `int`,
+`float`, `dict` and `list`; `class` is the dotted path of the token class from the root,
+eg "Status.Error.DbError" (all tokens must have the same root, and classes that appear
+only as parents are created as well)
+
+    JSON    [{"class": "Status.Success", "name": "COMPLETED", "int": 1}, ...]
+            (or {"tokens": [...]})
+    TOML    [[tokens]]
+            class = "Status.Success"
+            name = "COMPLETED"
+            int = 1
+    CSV     class,name,int,float,dict,list
+            Status.Success,COMPLETED,1,,,
+            (the dict and list columns are JSON; empty cells are missing values)
+
+the generated module defines the token classes, makes the root a root (with a global int
+index if all tokens have an int value), and defines all tokens with a single
+`Root.bulkdefine` call over a table of constants, which Python loads from the .pyc file
+in one go; all checks of `Token.__init__` are done by the generator instead; every token
+whose name is an identifier is also bound to a module level name
+
+(c) Stefan LOESCH, topaze.blue 2020.
+
+Licensed under the MIT license https://opensource.org/licenses/MIT
+"""
+import csv
+import json
+import keyword
+import math
+import os
+import sys
+
+FIELDS = ("class", "name", "int", "float", "dict", "list")
+
+def loadspec(path):
+    """
+    the list of token specs (dicts with the keys in FIELDS) in the JSON, TOML or CSV file path
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".json":
+        with open(path) as f:
+            spec = json.load(f)
+    elif extension == ".toml":
+        import tomllib
+        with open(path, "rb") as f:
+            spec = tomllib.load(f)
+    elif extension == ".csv":
+        with open(path, newline="") as f:
+            spec = [_fromcsv(row) for row in csv.DictReader(f)]
+    else:
+        raise RuntimeError("unknown spec format (must be .json, .toml or .csv)", path)
+    if isinstance(spec, dict):
+        spec = spec.get("tokens", [])
+    return spec
+
+def _fromcsv(row):
+    "the token spec from a row of a CSV spec"
+    result = {"class": row["class"], "name": row["name"]}
+    for field, convert in (("int", int), ("float", float), ("dict", json.loads), ("list", json.loads)):
+        if row.get(field):
+            result[field] = convert(row[field])
+    return result
+
+def _literal(value):
+    "the Python source of a value of a token spec"
+    if isinstance(value, float) and not math.isfinite(value):
+        return "float({!r})".format(repr(value))
+    if isinstance(value, list):
+        return "({}{})".format(", ".join(_literal(v) for v in value), "," if len(value) == 1 else "")
+    if isinstance(value, dict):
+        return "{{{}}}".format(", ".join("{!r}: {}".format(k, _literal(v)) for k, v in value.items()))
+    return repr(value)
+
+def validate(spec):
+    """
+    check a token spec, raising a RuntimeError for the first problem
+
+    :spec:          the list of token specs (see `loadspec`)
+    :returns:       (classpaths, globalNumIndex), the class paths in order of definition
+                    (parents first), and whether all tokens have an int value
+
+    if all tokens have an int value, the int values must be unique (as the generated root
+    then has a global int index)
+    """
+    classpaths, names, ints = {}, set(), set()
+    roots, nints, duplicate = set(), 0, None
+    for i, token in enumerate(spec):
+        unknown = set(token) - set(FIELDS)
+        if unknown:
+            raise RuntimeError("unknown fields in token spec", i, sorted(unknown))
+        path, name = token.get("class"), token.get("name")
+        if not isinstance(path, str) or not all(p.isidentifier() for p in path.split(".")):
+            raise RuntimeError("class of a token must be a dotted path of identifiers", i, path)
+        if not isinstance(name, str):
+            raise RuntimeError("token must have a string value", i, name)
+        if name in names:
+            raise RuntimeError("Token must be globally unique in this segment", name)
+        names.add(name)
+        if token.get("int") is not None:
+            if not isinstance(token["int"], int):
+                raise RuntimeError("int value of a token must be an int", name, token["int"])
+            if token["int"] in ints and duplicate is None:
+                duplicate = (name, token["int"])
+            ints.add(token["int"])
+            nints += 1
+        parts = path.split(".")
+        roots.add(parts[0])
+        for n in range(1, len(parts) + 1):
+            classpaths.setdefault(".".join(parts[:n]), None)
+    if not roots:
+        raise RuntimeError("token spec has no tokens")
+    if len(roots) > 1:
+        raise RuntimeError("all tokens must have the same root class", sorted(roots))
+    classnames = {}
+    for path in classpaths:
+        name = path.rsplit(".", 1)[-1]
+        if name == "Token" or classnames.setdefault(name, path) != path:
+            raise RuntimeError("class names must be unique (and not Token)", path)
+    if nints == len(spec) and duplicate is not None:
+        raise RuntimeError("Token must be globally unique in this segment", *duplicate)
+    return list(classpaths), nints == len(spec)
+
+def generate(spec, target=None, source=None):
+    """
+    generate the Python module with the token definitions of spec
+
+    :spec:          the list of token specs, or the path of a JSON, TOML or CSV spec file
+    :target:        the path of the generated module (optional)
+    :source:        the name of the spec in the module docstring (default: the spec path)
+    :returns:       the source code of the module
+    """
+    if isinstance(spec, str):
+        source = source or os.path.basename(spec)
+        spec = loadspec(spec)
+    classpaths, numindex = validate(spec)
+    classnames = [p.rsplit(".", 1)[-1] for p in classpaths]
+    classindex = {p: i for i, p in enumerate(classpaths)}
+    root = classnames[0]
+    reserved = set(classnames) | {"Token", "_CLASSES", "_ROWS", "_TOKENS"}
+
+    lines = [
+        '"""',
+        "token definitions generated by tokens_codegen{} -- do not edit".format(
+            " from {}".format(source) if source else ""),
+        '"""',
+        "from tokens import Token",
+        "",
+    ]
+    for path, name in zip(classpaths, classnames):
+        parent = path.rsplit(".", 1)[0].rsplit(".", 1)[-1] if "." in path else "Token"
+        lines.append("class {}({}): __slots__ = ()".format(name, parent))
+        if parent == "Token":
+            lines.append("{}.makeroot(globalIndex=True, globalNumIndex={})".format(name, numindex))
+    lines += ["", "_CLASSES = ({}{})".format(", ".join(classnames), "," if len(classnames) == 1 else ""), "_ROWS = ("]
+    for token in spec:
+        row = [classindex[token["class"]], token["name"]] + [token.get(f) for f in FIELDS[2:]]
+        while len(row) > 2 and row[-1] is None:
+            row.pop()
+        lines.append("    ({}{}),".format(", ".join(_literal(v) for v in row), "," if len(row) == 1 else ""))
+    lines += [")", "_TOKENS = {}.bulkdefine(_CLASSES, _ROWS, validate=False)".format(root), ""]
+    for i, token in enumerate(spec):
+        name = token["name"]
+        if name.isidentifier() and not keyword.iskeyword(name) and name not in reserved:
+            lines.append("{} = _TOKENS[{}]".format(name, i))
+    lines += ["del _ROWS, _TOKENS", ""]
+    code = "\n".join(lines)
+    if target is not None:
+        with open(target, "w") as f:
+            f.write(code)
+    return code
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python tokens_codegen.py <spec.json|spec.toml|spec.csv> <module.py>")
+        sys.exit(1)
+    generate(sys.argv[1], sys.argv[2])
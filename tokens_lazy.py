@@ -0,0 +1,170 @@
+"""
+lazy roots for huge vocabularies, backed by compact columns (see `Token.usestore`)
+
+    from tokens_lazy import define
+
+    class Sku(Token): pass
+    Sku.makeroot(globalNumIndex=True)
+    class Discontinued(Sku): pass
+    define(Sku, classes, names, ints)       # eg millions of rows read from a file
+    Sku.byval("SKU-0012345")                # created on first access
+
+the tokens of the root are held as columns rather than as token objects: the utf-8 string
+values in a single buffer with an `array("q")` of offsets, the class indices, ints and
+floats in typed arrays, an open addressing hash table of ordinals for the string values
+and a sorted array for the int values, which takes about 60 bytes per token plus the
+string; a token is created the first time it is looked up (via `byval`, `bynum`,
+`byordinal`, `tokens` etc) and then cached, so that tokens remain singletons
+
+(c) Stefan LOESCH, topaze.blue 2020.
+
+Licensed under the MIT license https://opensource.org/licenses/MIT
+"""
+import math
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+
+from tokens import TokenStore
+
+_INTNONE, _FLOATNONE = 1, 2
+
+class ColumnStore(TokenStore):
+    """
+    the tokens of a root held in compact columns, as a TokenStore
+
+    :root:          the root class
+    :classes:       the token class of every token (a sequence), or a single class for all
+    :strings:       the string values of the tokens (a sequence of unique str)
+    :ints:          the int values of the tokens (a sequence, None for missing; optional)
+    :floats:        the float values of the tokens (a sequence, None for missing; optional)
+
+    the ordinals of the tokens are their positions in the columns; raises a RuntimeError if
+    a string value or int value is not unique, or a class does not belong to root
+    """
+    def __init__(s, root, classes, strings, ints=None, floats=None):
+        root = root._root
+        n = s._len = len(strings)
+        if isinstance(classes, type):
+            classes = [classes] * n
+        # the classes with tokens in order of their first token (as in the register of a
+        # root whose tokens are defined one by one), followed by their other parent classes
+        tokenclasses = list(dict.fromkeys(classes))
+        for tokenclass in tokenclasses:
+            if tokenclass._root is not root:
+                raise RuntimeError("all classes must belong to the same root", tokenclass, root)
+        for tokenclass in list(tokenclasses) + [root]:
+            for c in tokenclass._rootmro():
+                if c not in tokenclasses: tokenclasses.append(c)
+        classindex = {c: i for i, c in enumerate(tokenclasses)}
+        s._classindices = array("I", map(classindex.__getitem__, classes))
+        counts = [0] * len(tokenclasses)
+        for i in s._classindices:
+            counts[i] += 1
+        s._classes = [(c.__qualname__, classindex[c.__bases__[0]] if c is not root else -1, count)
+                        for c, count in zip(tokenclasses, counts)]
+        s._classstarts = [0] + list(accumulate(counts))
+        s._classordinals = array("I", sorted(range(n), key=s._classindices.__getitem__))
+
+        encoded = [strval.encode() for strval in strings]
+        s._strings = b"".join(encoded)
+        s._offsets = array("q", [0])
+        s._offsets.extend(accumulate(map(len, encoded)))
+        size = 1 << max(3, (2 * n).bit_length())
+        table = s._table = array("q", [-1]) * size
+        mask = size - 1
+        for ordinal, strval in enumerate(strings):
+            i = hash(strval) & mask
+            while table[i] >= 0:
+                if encoded[table[i]] == encoded[ordinal]:
+                    raise RuntimeError("Token must be globally unique in this segment", strval)
+                i = (i + 1) & mask
+            table[i] = ordinal
+
+        s._nulls = bytearray(n)
+        ints = [None] * n if ints is None else ints
+        floats = [None] * n if floats is None else floats
+        for i, (intval, floatval) in enumerate(zip(ints, floats)):
+            s._nulls[i] = (_INTNONE if intval is None else 0) | (_FLOATNONE if floatval is None else 0)
+        s._ints = array("q", [0 if intval is None else intval for intval in ints])
+        s._floats = array("d", [math.nan if floatval is None else floatval for floatval in floats])
+        intordinals = sorted((o for o in range(n) if ints[o] is not None), key=ints.__getitem__)
+        s._intkeys = array("q", [ints[o] for o in intordinals])
+        s._intordinals = array("I", intordinals)
+        for a, b in zip(s._intkeys, s._intkeys[1:]):
+            if a == b:
+                raise RuntimeError("Token must be globally unique in this segment", a)
+
+    _COLUMNS = ("_strings", "_offsets", "_classindices", "_ints", "_floats", "_nulls", "_table",
+                "_intkeys", "_intordinals", "_classordinals")
+
+    @property
+    def nbytes(s):
+        "the number of bytes held by the columns"
+        return sum(len(memoryview(getattr(s, name)).cast("B")) for name in s._COLUMNS)
+
+    def __len__(s):
+        return s._len
+
+    def classes(s):
+        return s._classes
+
+    def row(s, ordinal):
+        nulls = s._nulls[ordinal]
+        return (s._classindices[ordinal],
+                bytes(s._strings[s._offsets[ordinal]:s._offsets[ordinal+1]]).decode(),
+                None if nulls & _INTNONE else s._ints[ordinal],
+                None if nulls & _FLOATNONE else s._floats[ordinal])
+
+    def find(s, strval):
+        if not isinstance(strval, str):
+            return None
+        try:
+            data = strval.encode()
+        except UnicodeEncodeError:
+            return None
+        table, strings, offsets = s._table, s._strings, s._offsets
+        mask = len(table) - 1
+        i = hash(strval) & mask
+        while True:
+            ordinal = table[i]
+            if ordinal < 0:
+                return None
+            if strings[offsets[ordinal]:offsets[ordinal+1]] == data:
+                return ordinal
+            i = (i + 1) & mask
+
+    def findint(s, intval):
+        keys = s._intkeys
+        try:
+            i = bisect_left(keys, intval)
+        except TypeError:
+            return None
+        if i < len(keys) and keys[i] == intval:
+            return s._intordinals[i]
+        return None
+
+    def classordinals(s, classindex, offset=0, limit=None):
+        start, end = s._classstarts[classindex] + offset, s._classstarts[classindex+1]
+        if limit is not None:
+            end = min(end, start + limit)
+        return s._classordinals[start:end].tolist()
+
+    def strings(s):
+        strings, offsets = s._strings, s._offsets
+        return (str(strings[offsets[i]:offsets[i+1]], "utf-8") for i in range(s._len))
+
+    def ints(s):
+        return s._intkeys
+
+def define(root, classes, strings, ints=None, floats=None, cacheSize=None):
+    """
+    back root by the tokens given as columns (see module docstring and ColumnStore)
+
+    :root:          the root class; must be created with makeroot() and must not have tokens
+    :cacheSize:     see `Token.usestore`
+    :returns:       the ColumnStore
+    """
+    store = ColumnStore(root, classes, strings, ints, floats)
+    root.usestore(store, cacheSize)
+    return store
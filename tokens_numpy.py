@@ -0,0 +1,148 @@
+"""
+vectorized conversion between token sequences and NumPy arrays (optional, requires numpy)
+
+    from tokens_numpy import encode, decode, isin
+
+    codes = encode(events)              # int64 array of the token ordinals
+    events = decode(codes, Status)      # object array of the tokens
+    errors = isin(codes, Error)         # boolean mask, True where the token is an Error
+
+decoding and membership tests use lookup tables indexed by ordinal that are built once per
+root (or token class) and cached with its listings, so they are rebuilt only after tokens
+have been registered; int values (see `ints=True`) are first mapped to ordinals via the int
+index of the root, which requires `makeroot(globalNumIndex=True)`
+
+(c) Stefan LOESCH, topaze.blue 2020.
+
+Licensed under the MIT license https://opensource.org/licenses/MIT
+"""
+from operator import attrgetter
+
+import numpy as np
+
+from tokens import FrozenTokenSet
+
+_getordinal = attrgetter("_ordinal")
+_getint = attrgetter("_int")
+
+def _cached(tokenclass, key, build):
+    "the value cached as `key` with the listings of tokenclass, built by build() if missing"
+    listings = tokenclass._classlistings()
+    try:
+        return listings[key]
+    except KeyError:
+        value = listings[key] = build()
+        return value
+
+def _ordinaltable(root):
+    "object array of all tokens of root, indexed by ordinal"
+    def build():
+        table = np.empty(len(root._ordinals), dtype=object)
+        table[:] = list(root._ordinals)
+        return table
+    return _cached(root, "numpy.ordinals", build)
+
+def _inttable(root):
+    """
+    the lookup from int values to ordinals of root, as (offset, table) with table[int-offset]
+    the ordinal or -1 if the int values are dense enough, otherwise as (keys, ordinals) sorted
+    by key for `searchsorted`
+    """
+    def build():
+        items = sorted((i, t._ordinal) for i, t in root._numindex.items())
+        keys = np.array([i for i, _ in items], dtype=np.int64)
+        ordinals = np.array([o for _, o in items], dtype=np.int64)
+        if len(keys) and keys[-1] - keys[0] < 4 * len(keys) + 1024:
+            table = np.full(keys[-1] - keys[0] + 1, -1, dtype=np.int64)
+            table[keys - keys[0]] = ordinals
+            return int(keys[0]), table
+        return keys, ordinals
+    return _cached(root, "numpy.ints", build)
+
+def _masktable(mask, n):
+    "boolean array of length n with True at the bits set in mask"
+    raw = np.frombuffer(mask.to_bytes((n + 7) // 8, "little"), dtype=np.uint8)
+    return np.unpackbits(raw, bitorder="little")[:n].astype(bool)
+
+def _lookup(table, indices, fill):
+    "table[indices], with fill where indices is out of range"
+    valid = (indices >= 0) & (indices < len(table))
+    if valid.all():
+        return table[indices]
+    result = np.full(indices.shape, fill, dtype=table.dtype)
+    result[valid] = table[indices[valid]]
+    return result
+
+def toordinals(codes, root):
+    """
+    convert an array of int values of tokens of root to an array of ordinals
+
+    :codes:         array-like of int values
+    :root:          the root class (or any class under it)
+    :returns:       int64 array of the ordinals, with -1 for int values that are not a token
+    """
+    root = root._root
+    codes = np.asarray(codes, dtype=np.int64)
+    first, table = _inttable(root)
+    if isinstance(first, int):
+        return _lookup(table, codes - first, -1)
+    keys, ordinals = first, table
+    if not len(keys):
+        return np.full(codes.shape, -1, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(keys, codes), len(keys) - 1)
+    found = keys[positions] == codes
+    return np.where(found, ordinals[positions], -1)
+
+def encode(tokens, root=None, ints=False, dtype=np.int64):
+    """
+    encode a sequence of tokens as an array of their ordinals (or int values)
+
+    :tokens:        an iterable of tokens, all of the same root
+    :root:          the root class (optional; defaults to the root of the first token)
+    :ints:          if True, encode the int values of the tokens rather than their ordinals
+    :dtype:         the dtype of the result (default: int64)
+    :returns:       the array of ordinals (or int values)
+    """
+    if not isinstance(tokens, (list, tuple)):
+        tokens = list(tokens)
+    if not tokens:
+        return np.empty(0, dtype=dtype)
+    root = tokens[0]._root if root is None else root._root
+    for token in set(tokens):
+        if token._root is not root:
+            raise RuntimeError("all tokens must belong to the same root", token, root)
+    return np.fromiter(map(_getint if ints else _getordinal, tokens), dtype=dtype, count=len(tokens))
+
+def decode(codes, root, ints=False, missing=None, asList=False):
+    """
+    decode an array of ordinals (or int values) into the tokens of root
+
+    :codes:         array-like of ordinals (or int values)
+    :root:          the root class (or any class under it)
+    :ints:          if True, codes are the int values of the tokens rather than their ordinals
+    :missing:       the value returned in place of codes that are not a token (default: None)
+    :asList:        if True return a list rather than an object array
+    :returns:       the object array (or list) of tokens
+    """
+    root = root._root
+    ordinals = toordinals(codes, root) if ints else np.asarray(codes, dtype=np.int64)
+    result = _lookup(_ordinaltable(root), ordinals, missing)
+    return result.tolist() if asList else result
+
+def isin(codes, tokens, ints=False):
+    """
+    whether the tokens encoded in codes belong to a token class or token set
+
+    :codes:         array-like of ordinals (or int values)
+    :tokens:        a token class (tokens of the class and its subclasses) or a FrozenTokenSet
+    :ints:          if True, codes are the int values of the tokens rather than their ordinals
+    :returns:       boolean array of the same shape as codes
+    """
+    if isinstance(tokens, FrozenTokenSet):
+        root = tokens.root
+        table = _masktable(tokens.mask, len(root._ordinals))
+    else:
+        root = tokens._root
+        table = _cached(tokens, "numpy.isin", lambda: _masktable(tokens._tokenmask(), len(root._ordinals)))
+    ordinals = toordinals(codes, root) if ints else np.asarray(codes, dtype=np.int64)
+    return _lookup(table, ordinals, False)
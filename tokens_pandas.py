@@ -0,0 +1,278 @@
+"""
+pandas extension dtype for columns of tokens (optional, requires pandas and numpy)
+
+    from tokens_pandas import TokenDtype, TokenArray
+
+    df["status"] = TokenArray.from_strings(df["status"], Status)   # or .astype(TokenDtype(Status))
+    df[df["status"].tokens.isof(Error)]
+    df.groupby("status").size()
+
+a token column stores the token ordinals as an int32 array (-1 for missing values), like a
+Categorical whose categories are the tokens of a makeroot() root; the `tokens` accessor of a
+Series provides hierarchy filtering; when pyarrow is installed, token columns are stored as
+dictionary encoded (categorical) columns in parquet files and read back as token columns
+(see tokens_arrow)
+
+(c) Stefan LOESCH, topaze.blue 2020.
+
+Licensed under the MIT license https://opensource.org/licenses/MIT
+"""
+import importlib
+import numbers
+import sys
+
+import numpy as np
+import pandas as pd
+from pandas.api.extensions import (ExtensionArray, ExtensionDtype, register_extension_dtype,
+                                    register_series_accessor)
+from pandas.api.indexers import check_array_indexer
+
+from tokens import Token
+from tokens_numpy import decode, isin
+
+@register_extension_dtype
+class TokenDtype(ExtensionDtype):
+    """
+    pandas dtype of a column of tokens of one root
+
+    :root:      the root class (or any class under it)
+
+    the string name of the dtype is "token[<module>:<root qualname>]", and can be used with
+    `astype` if the root class is importable from the module
+    """
+    type = Token
+    kind = "O"
+    na_value = None
+    _metadata = ("root",)
+
+    def __init__(s, root=None):
+        s.root = root._root if root is not None else None
+
+    @property
+    def name(s):
+        if s.root is None: return "token"
+        return "token[{}]".format(s.root.rootname())
+
+    @classmethod
+    def construct_array_type(cls):
+        return TokenArray
+
+    @classmethod
+    def construct_from_string(cls, string):
+        if not isinstance(string, str):
+            raise TypeError("'construct_from_string' expects a string, got {}".format(type(string)))
+        if string == "token":
+            return cls()
+        if not (string.startswith("token[") and string.endswith("]") and ":" in string):
+            raise TypeError("cannot construct a 'TokenDtype' from '{}'".format(string))
+        modulename, qualname = string[6:-1].split(":", 1)
+        try:
+            root = sys.modules.get(modulename) or importlib.import_module(modulename)
+            for name in qualname.split("."):
+                root = getattr(root, name)
+        except (ImportError, AttributeError):
+            raise TypeError("cannot construct a 'TokenDtype' from '{}'".format(string))
+        return cls(root)
+
+    def __from_arrow__(s, array):
+        import tokens_arrow
+        ordinals = tokens_arrow.toordinals(array, s.root)
+        return TokenArray(ordinals.fill_null(-1).to_numpy(), s)
+
+class TokenArray(ExtensionArray):
+    """
+    pandas extension array of tokens of one root, stored as int32 ordinals (-1 for missing)
+
+    :codes:     the ordinals (array-like of ints)
+    :dtype:     the TokenDtype (or the root class)
+    """
+    def __init__(s, codes, dtype):
+        if not isinstance(dtype, TokenDtype):
+            dtype = TokenDtype(dtype)
+        s._codes = np.asarray(codes, dtype=np.int32)
+        s._dtype = dtype
+
+    @classmethod
+    def from_strings(cls, strings, root):
+        """
+        the token array of root from the string values of the tokens (via `byvals`)
+
+        :strings:       array-like of strings (None, NaN or unknown strings become missing)
+        :root:          the root class (or any class under it)
+
+        the strings are factorized first, so each distinct string is looked up only once
+        """
+        indices, uniques = pd.factorize(np.asarray(strings, dtype=object))
+        lookup = np.array([-1 if t is None else t._ordinal for t in root.byvals(uniques)] + [-1], dtype=np.int64)
+        return cls(lookup[indices], root)
+
+    @classmethod
+    def _from_sequence(cls, scalars, *, dtype=None, copy=False):
+        if isinstance(scalars, TokenArray):
+            return scalars.copy() if copy else scalars
+        if dtype is not None and not isinstance(dtype, TokenDtype):
+            dtype = pd.api.types.pandas_dtype(dtype)
+        if dtype is None or dtype.root is None:
+            first = next((x for x in scalars if isinstance(x, Token)), None)
+            if first is None:
+                raise TypeError("cannot infer the root of a token array without a token")
+            dtype = TokenDtype(first)
+        root = dtype.root
+        codes = np.empty(len(scalars), dtype=np.int32)
+        for i, x in enumerate(scalars):
+            if isinstance(x, Token):
+                if x._root is not root:
+                    raise TypeError("all tokens must belong to the same root", x, root)
+                codes[i] = x._ordinal
+            elif isinstance(x, str):
+                token = root.byval(x, noneIfMissing=True)
+                codes[i] = -1 if token is None else token._ordinal
+            else:
+                codes[i] = -1
+        return cls(codes, dtype)
+
+    @classmethod
+    def _from_sequence_of_strings(cls, strings, *, dtype=None, copy=False):
+        if not isinstance(dtype, TokenDtype):
+            dtype = pd.api.types.pandas_dtype(dtype)
+        return cls.from_strings(strings, dtype.root)
+
+    @classmethod
+    def _from_factorized(cls, values, original):
+        return cls(values, original.dtype)
+
+    @classmethod
+    def _concat_same_type(cls, to_concat):
+        return cls(np.concatenate([a._codes for a in to_concat]), to_concat[0].dtype)
+
+    @property
+    def dtype(s):
+        return s._dtype
+
+    @property
+    def codes(s):
+        "the ordinals of the tokens (-1 for missing values)"
+        return s._codes
+
+    @property
+    def nbytes(s):
+        return s._codes.nbytes
+
+    def __len__(s):
+        return len(s._codes)
+
+    def __getitem__(s, item):
+        if isinstance(item, numbers.Integral):
+            code = s._codes[item]
+            return None if code < 0 else s._dtype.root._ordinals[code]
+        item = check_array_indexer(s, item)
+        return s.__class__(s._codes[item], s._dtype)
+
+    def __setitem__(s, key, value):
+        key = check_array_indexer(s, key)
+        if isinstance(value, TokenArray):
+            value = value._codes
+        elif pd.api.types.is_list_like(value):
+            value = s._from_sequence(value, dtype=s._dtype)._codes
+        else:
+            value = s._from_sequence([value], dtype=s._dtype)._codes[0]
+        s._codes[key] = value
+
+    def __iter__(s):
+        ordinals = s._dtype.root._ordinals
+        for code in s._codes.tolist():
+            yield None if code < 0 else ordinals[code]
+
+    def __array__(s, dtype=None, copy=None):
+        return decode(s._codes, s._dtype.root)
+
+    def __eq__(s, other):
+        if isinstance(other, (pd.Series, pd.Index, pd.DataFrame)):
+            return NotImplemented
+        if isinstance(other, TokenArray):
+            if other._dtype.root is not s._dtype.root:
+                return np.zeros(len(s), dtype=bool)
+            return (s._codes == other._codes) & (s._codes >= 0)
+        if isinstance(other, Token):
+            if other._root is not s._dtype.root:
+                return np.zeros(len(s), dtype=bool)
+            return s._codes == other._ordinal
+        return np.asarray(s, dtype=object) == other
+
+    def __ne__(s, other):
+        result = s.__eq__(other)
+        if result is NotImplemented: return result
+        return ~result
+
+    def isna(s):
+        return s._codes < 0
+
+    def isof(s, tokens):
+        "boolean array, True where the token belongs to tokens (a token class or FrozenTokenSet)"
+        return isin(s._codes, tokens)
+
+    def take(s, indices, allow_fill=False, fill_value=None):
+        from pandas.api.extensions import take
+        if allow_fill and fill_value is not None:
+            fill_value = s._from_sequence([fill_value], dtype=s._dtype)._codes[0]
+        else:
+            fill_value = -1
+        codes = take(s._codes, indices, allow_fill=allow_fill, fill_value=fill_value)
+        return s.__class__(codes, s._dtype)
+
+    def copy(s):
+        return s.__class__(s._codes.copy(), s._dtype)
+
+    def _values_for_factorize(s):
+        return s._codes, -1
+
+    def _values_for_argsort(s):
+        return s._codes
+
+    def to_categorical(s):
+        "the array as a pandas Categorical whose categories are all token strings of the root"
+        return pd.Categorical.from_codes(s._codes, categories=[t._str for t in s._dtype.root._ordinals])
+
+    @classmethod
+    def from_categorical(cls, categorical, root):
+        "the token array of root from a Categorical of token strings (one byvals for the categories)"
+        lookup = np.array([-1 if t is None else t._ordinal for t in root.byvals(categorical.categories)] + [-1],
+                            dtype=np.int64)
+        return cls(lookup[categorical.codes], root)
+
+    def __arrow_array__(s, type=None):
+        import tokens_arrow
+        return tokens_arrow.fromordinals(s._codes, s._dtype.root, mask=s._codes < 0)
+
+@register_series_accessor("tokens")
+class TokenAccessor:
+    """
+    the `tokens` accessor of a Series of tokens (`series.tokens.isof(Error)`)
+    """
+    def __init__(s, series):
+        if not isinstance(series.dtype, TokenDtype):
+            raise AttributeError("the tokens accessor requires a TokenDtype column")
+        s._series = series
+
+    @property
+    def root(s):
+        "the root class of the tokens"
+        return s._series.dtype.root
+
+    @property
+    def codes(s):
+        "the ordinals of the tokens as an int32 Series (-1 for missing values)"
+        return pd.Series(s._series.array.codes, index=s._series.index, name=s._series.name)
+
+    @property
+    def str(s):
+        "the string values of the tokens as an object Series (None for missing values)"
+        return s._series.map(lambda t: None if t is None else t._str, na_action="ignore")
+
+    def isof(s, tokens):
+        "boolean Series, True where the token belongs to tokens (a token class or FrozenTokenSet)"
+        return pd.Series(s._series.array.isof(tokens), index=s._series.index, name=s._series.name)
+
+    def to_categorical(s):
+        "the column as a categorical Series of token strings"
+        return pd.Series(s._series.array.to_categorical(), index=s._series.index, name=s._series.name)
@@ -0,0 +1,237 @@
+"""
+precompiled token registry files, memory-mapped at startup (see `Token.usestore`)
+
+    from tokens_registry import compile, load
+
+    compile(Status, "status.tokens")    # once (eg at build time), with all tokens defined
+
+    class Status(Token): pass           # at startup, instead of defining the tokens
+    Status.makeroot()
+    load(Status, "status.tokens")
+    Status.byval("COMPLETED")           # created on first access
+
+a registry file holds the token classes of a root (qualname and parent), and its tokens in
+ordinal order as columns: the utf-8 string values in a single buffer with offsets, and the
+class indices, ints and floats as fixed width arrays; string values are found through a
+perfect hash table (hash and displace), int values through a sorted array; loading a file
+only parses a small json header and memory-maps the rest, so it takes the same time for
+ten or ten million tokens, and no `Token.__init__` runs at all; tokens are created when
+they are first looked up (via `byval`, `bynum`, `byordinal` etc)
+
+registry files require unique string values across the root (ie `makeroot(globalIndex=True)`),
+int values that fit into 64 bits, and tokens without dict or list values
+
+(c) Stefan LOESCH, topaze.blue 2020.
+
+Licensed under the MIT license https://opensource.org/licenses/MIT
+"""
+import hashlib
+import json
+import math
+import mmap
+from array import array
+
+from tokens_lazy import ColumnStore, _INTNONE, _FLOATNONE
+
+MAGIC = b"TOKF"
+VERSION = 1
+EMPTY = 0xFFFFFFFF
+
+def _hashes(data, seed):
+    "three 32 bit hashes of data (bucket, first slot, slot step) for the perfect hash table"
+    digest = hashlib.blake2b(data, digest_size=12, salt=seed.to_bytes(16, "little")).digest()
+    return (int.from_bytes(digest[0:4], "little"), int.from_bytes(digest[4:8], "little"),
+            int.from_bytes(digest[8:12], "little") | 1)
+
+def _perfecthash(keys, seed):
+    """
+    the perfect hash table of keys (a list of unique bytes) as (displacements, slots), or
+    None if no table could be found with this seed
+
+    keys are hashed into len(keys)/4 buckets; for the buckets in order of decreasing size a
+    displacement d is searched so that all keys k of the bucket land on free slots
+    (first(k) + d * step(k)) % nslots, with 25% more slots than keys
+    """
+    nbuckets = max(1, len(keys) // 4)
+    nslots = max(1, len(keys) + len(keys) // 4)
+    hashes = [_hashes(key, seed) for key in keys]
+    buckets = [[] for _ in range(nbuckets)]
+    for ordinal, (bucket, _, _) in enumerate(hashes):
+        buckets[bucket % nbuckets].append(ordinal)
+    displacements = array("I", [0]) * nbuckets
+    slots = array("I", [EMPTY]) * nslots
+    for bucket in sorted(range(nbuckets), key=lambda b: -len(buckets[b])):
+        members = buckets[bucket]
+        if not members: break
+        for d in range(4 * nslots):
+            positions = [(hashes[o][1] + d * hashes[o][2]) % nslots for o in members]
+            if len(set(positions)) == len(positions) and all(slots[p] == EMPTY for p in positions):
+                break
+        else:
+            return None
+        displacements[bucket] = d
+        for o, p in zip(members, positions):
+            slots[p] = o
+    return displacements, slots
+
+def compile(root, path):
+    """
+    write the tokens of root (all of them have to be defined) to a registry file
+
+    :root:          the root class (or any class under it); must not be store backed
+    :path:          the path of the registry file
+    """
+    root = root._root
+    if root._store is not None:
+        raise RuntimeError("cannot compile a store backed root", root)
+    tokens = list(root._ordinals)
+    classes = list(root._register)
+    for tokenclass in root.allsubclasses(namesOnly=False):
+        if tokenclass not in root._register: classes.append(tokenclass)
+    classindex = {c: i for i, c in enumerate(classes)}
+    strings, seen = [], set()
+    for token in tokens:
+        if not isinstance(token._str, str):
+            raise RuntimeError("registry files require string values", token)
+        if token._dict is not None or token._list is not None:
+            raise RuntimeError("registry files do not support dict or list values", token)
+        if token._str in seen:
+            raise RuntimeError("registry files require unique string values", token)
+        seen.add(token._str)
+        strings.append(token._str.encode())
+
+    offsets = array("Q", [0])
+    for data in strings:
+        offsets.append(offsets[-1] + len(data))
+    nulls = bytes((_INTNONE if t._int is None else 0) | (_FLOATNONE if t._float is None else 0) for t in tokens)
+    try:
+        ints = array("q", [0 if t._int is None else t._int for t in tokens])
+    except OverflowError:
+        raise RuntimeError("registry files require int values that fit into 64 bits")
+    floats = array("d", [math.nan if t._float is None else t._float for t in tokens])
+    intitems = sorted((t._int, t._ordinal) for t in tokens if t._int is not None)
+    for (a, _), (b, _) in zip(intitems, intitems[1:]):
+        if a == b:
+            raise RuntimeError("registry files require unique int values", a)
+    classordinals = array("I", [t._ordinal for c in classes for t in root._register.get(c, {}).values()])
+    seed = 0
+    while True:
+        table = _perfecthash(strings, seed)
+        if table is not None: break
+        seed += 1
+    displacements, slots = table
+
+    sections = {
+        "offsets":          offsets,
+        "strings":          b"".join(strings),
+        "classes":          array("I", [classindex[t.__class__] for t in tokens]),
+        "ints":             ints,
+        "floats":           floats,
+        "nulls":            nulls,
+        "displacements":    displacements,
+        "slots":            slots,
+        "intkeys":          array("q", [i for i, _ in intitems]),
+        "intordinals":      array("I", [o for _, o in intitems]),
+        "classordinals":    classordinals,
+    }
+    layout, position = {}, 0
+    for name, data in sections.items():
+        nbytes = len(memoryview(data).cast("B"))
+        layout[name] = (position, nbytes)
+        position += (nbytes + 7) // 8 * 8
+    header = json.dumps({
+        "root":         root.rootname(),
+        "fingerprint":  root.fingerprint().hex(),
+        "classes":      [(c.__qualname__, classindex.get(c.__bases__[0], -1) if c is not root else -1,
+                            len(root._register.get(c, ()))) for c in classes],
+        "ntokens":      len(tokens),
+        "seed":         seed,
+        "sections":     layout,
+    }).encode()
+    start = (len(MAGIC) + 8 + len(header) + 7) // 8 * 8
+    with open(path, "wb") as f:
+        f.write(MAGIC + VERSION.to_bytes(4, "little") + len(header).to_bytes(4, "little") + header)
+        f.write(bytes(start - f.tell()))
+        for name, data in sections.items():
+            f.write(bytes(start + layout[name][0] - f.tell()))
+            f.write(data)
+
+class RegistryFile(ColumnStore):
+    """
+    a memory-mapped registry file, as a TokenStore (see `compile` and `load`); the columns
+    are those of ColumnStore, as views of the file
+
+    :path:      the path of the registry file
+    """
+    _COLUMNS = ("_strings", "_offsets", "_classindices", "_ints", "_floats", "_nulls", "_displacements",
+                "_slots", "_intkeys", "_intordinals", "_classordinals")
+
+    def __init__(s, path):
+        with open(path, "rb") as f:
+            prefix = f.read(len(MAGIC) + 8)
+            if prefix[:len(MAGIC)] != MAGIC:
+                raise RuntimeError("not a token registry file (bad magic number)", path)
+            version = int.from_bytes(prefix[4:8], "little")
+            if version != VERSION:
+                raise RuntimeError("unsupported token registry file version", version)
+            header = json.loads(f.read(int.from_bytes(prefix[8:12], "little")))
+            s._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        s.header = header
+        s._classes = [tuple(c) for c in header["classes"]]
+        s._len = header["ntokens"]
+        s._seed = header["seed"]
+        start = (len(MAGIC) + 8 + int.from_bytes(prefix[8:12], "little") + 7) // 8 * 8
+        view = memoryview(s._mmap)
+        def section(name, fmt):
+            offset, nbytes = header["sections"][name]
+            return view[start+offset:start+offset+nbytes].cast(fmt)
+        s._offsets = section("offsets", "Q")
+        s._strings = section("strings", "B")
+        s._classindices = section("classes", "I")
+        s._ints = section("ints", "q")
+        s._floats = section("floats", "d")
+        s._nulls = section("nulls", "B")
+        s._displacements = section("displacements", "I")
+        s._slots = section("slots", "I")
+        s._intkeys = section("intkeys", "q")
+        s._intordinals = section("intordinals", "I")
+        s._classordinals = section("classordinals", "I")
+        s._classstarts = [0]
+        for _, _, count in s._classes:
+            s._classstarts.append(s._classstarts[-1] + count)
+
+    @property
+    def rootname(s):
+        "the name of the root the file was compiled from"
+        return s.header["root"]
+
+    def find(s, strval):
+        try:
+            data = strval.encode()
+        except (AttributeError, UnicodeEncodeError):
+            return None
+        if not s._len: return None
+        bucket, first, step = _hashes(data, s._seed)
+        d = s._displacements[bucket % len(s._displacements)]
+        ordinal = s._slots[(first + d * step) % len(s._slots)]
+        if ordinal == EMPTY or s._strings[s._offsets[ordinal]:s._offsets[ordinal+1]] != data:
+            return None
+        return ordinal
+
+    def fingerprint(s):
+        return bytes.fromhex(s.header["fingerprint"])
+
+def load(root, path, cacheSize=None):
+    """
+    back root by the registry file at path (see module docstring and `Token.usestore`)
+
+    :root:          the root class; must be created with makeroot() and must not have tokens
+    :path:          the path of the registry file
+    :cacheSize:     see `Token.usestore`
+    :returns:       the RegistryFile
+    """
+    store = RegistryFile(path)
+    if store.rootname != root.rootname():
+        raise RuntimeError("token registry file is for a different root", store.rootname, root.rootname())
+    root.usestore(store, cacheSize)
+    return store
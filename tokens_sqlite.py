@@ -0,0 +1,204 @@
+"""
+SQLite backed roots for vocabularies that do not fit into memory (see `Token.usestore`)
+
+    from tokens_sqlite import create, load
+
+    create("skus.db", Sku, rows)        # once; rows is an iterable of (class, str, int, float)
+
+    class Sku(Token): pass              # in every process
+    Sku.makeroot(globalNumIndex=True)
+    load(Sku, "skus.db")
+    Sku.byval("SKU-0012345")            # one indexed query, then cached
+
+the tokens of the root are rows of a table indexed on string value, int value and class,
+in a local SQLite file that is opened read-only; a token is created the first time it is
+looked up, and only a bounded number of tokens is kept alive (`cacheSize`, least recently
+used first; tokens that are still referenced elsewhere are always kept, so tokens remain
+singletons); misses are remembered in a bounded negative lookup cache, so that repeated
+lookups of unknown values do not query the database again
+
+(c) Stefan LOESCH, topaze.blue 2020.
+
+Licensed under the MIT license https://opensource.org/licenses/MIT
+"""
+import hashlib
+import pathlib
+import sqlite3
+from collections import OrderedDict
+
+from tokens import TokenStore
+
+CACHESIZE = 100000
+MISSCACHESIZE = 100000
+BATCHSIZE = 100000
+
+_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value BLOB);
+CREATE TABLE classes (idx INTEGER PRIMARY KEY, qualname TEXT NOT NULL, parent INTEGER NOT NULL, count INTEGER NOT NULL);
+CREATE TABLE tokens (ordinal INTEGER PRIMARY KEY, class INTEGER NOT NULL, str TEXT NOT NULL, int INTEGER, float REAL);
+"""
+_INDEXES = """
+CREATE UNIQUE INDEX tokens_str ON tokens (str);
+CREATE UNIQUE INDEX tokens_int ON tokens (int) WHERE int IS NOT NULL;
+CREATE INDEX tokens_class ON tokens (class, ordinal);
+"""
+
+def create(path, root, rows):
+    """
+    create a token database for root
+
+    :path:      the path of the database file (must not exist)
+    :root:      the root class
+    :rows:      an iterable of tuples (token class, strval, intval, floatval) in ordinal
+                order, where intval and floatval can be omitted (or None)
+    :returns:   the number of tokens
+
+    the rows are inserted in batches and the indexes are built at the end; raises a
+    RuntimeError if a string value or int value is not unique
+    """
+    root = root._root
+    if pathlib.Path(path).exists():
+        raise RuntimeError("token database already exists", path)
+    classindex = {}
+    fingerprint = hashlib.blake2b(digest_size=16)
+    def index(tokenclass):
+        try:
+            return classindex[tokenclass]
+        except KeyError:
+            if tokenclass._root is not root:
+                raise RuntimeError("all classes must belong to the same root", tokenclass, root)
+            result = classindex[tokenclass] = len(classindex)
+            return result
+    def records():
+        for ordinal, row in enumerate(rows):
+            tokenclass, strval = row[0], row[1]
+            intval = row[2] if len(row) > 2 else None
+            floatval = row[3] if len(row) > 3 else None
+            fingerprint.update(repr((tokenclass.__qualname__, strval, intval)).encode())
+            yield ordinal, index(tokenclass), strval, intval, floatval
+    connection = sqlite3.connect(path)
+    try:
+        connection.executescript("PRAGMA journal_mode=OFF; PRAGMA synchronous=OFF;" + _SCHEMA)
+        records = records()
+        while True:
+            batch = [record for _, record in zip(range(BATCHSIZE), records)]
+            if not batch: break
+            connection.executemany("INSERT INTO tokens VALUES (?, ?, ?, ?, ?)", batch)
+        try:
+            connection.executescript(_INDEXES)
+        except sqlite3.IntegrityError as e:
+            raise RuntimeError("Token must be globally unique in this segment", str(e))
+        counts = dict(connection.execute("SELECT class, count(*) FROM tokens GROUP BY class"))
+        for tokenclass in list(classindex) + [root]:
+            for c in tokenclass._rootmro():
+                index(c)
+        connection.executemany("INSERT INTO classes VALUES (?, ?, ?, ?)",
+            [(i, c.__qualname__, classindex[c.__bases__[0]] if c is not root else -1, counts.get(i, 0))
+                for c, i in classindex.items()])
+        connection.executemany("INSERT INTO meta VALUES (?, ?)",
+            [("root", root.rootname()), ("fingerprint", fingerprint.digest())])
+        connection.commit()
+    except BaseException:
+        connection.close()
+        pathlib.Path(path).unlink()
+        raise
+    connection.close()
+    return sum(counts.values())
+
+class SqliteStore(TokenStore):
+    """
+    a token database (see `create`), opened read-only, as a TokenStore
+
+    :path:              the path of the database file
+    :missCacheSize:     the number of missing string and int values remembered
+    """
+    def __init__(s, path, missCacheSize=MISSCACHESIZE):
+        uri = pathlib.Path(path).resolve().as_uri() + "?mode=ro"
+        s._connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        s._connection.execute("PRAGMA mmap_size=268435456")
+        meta = dict(s._connection.execute("SELECT key, value FROM meta"))
+        s.rootname = meta["root"]
+        s._fingerprint = meta["fingerprint"]
+        s._classes = [tuple(c) for c in s._connection.execute(
+                        "SELECT qualname, parent, count FROM classes ORDER BY idx")]
+        s._len = sum(c[2] for c in s._classes)
+        s._missCacheSize = missCacheSize
+        s._misses = OrderedDict()
+
+    def _miss(s, key):
+        "remember a missing value (key is (\"str\", strval) or (\"int\", intval))"
+        misses = s._misses
+        misses[key] = None
+        if len(misses) > s._missCacheSize:
+            misses.popitem(last=False)
+
+    def __len__(s):
+        return s._len
+
+    def classes(s):
+        return s._classes
+
+    def row(s, ordinal):
+        return s._connection.execute("SELECT class, str, int, float FROM tokens WHERE ordinal = ?",
+                                        (ordinal,)).fetchone()
+
+    def find(s, strval):
+        if not isinstance(strval, str) or ("str", strval) in s._misses:
+            return None
+        result = s._connection.execute("SELECT ordinal FROM tokens WHERE str = ?", (strval,)).fetchone()
+        if result is None:
+            s._miss(("str", strval))
+            return None
+        return result[0]
+
+    def findint(s, intval):
+        if not isinstance(intval, int) or ("int", intval) in s._misses:
+            return None
+        try:
+            result = s._connection.execute("SELECT ordinal FROM tokens WHERE int = ?", (intval,)).fetchone()
+        except OverflowError:
+            result = None
+        if result is None:
+            s._miss(("int", intval))
+            return None
+        return result[0]
+
+    def classordinals(s, classindex, offset=0, limit=None):
+        return [o for o, in s._connection.execute(
+                    "SELECT ordinal FROM tokens WHERE class = ? ORDER BY ordinal LIMIT ? OFFSET ?",
+                    (classindex, -1 if limit is None else limit, offset))]
+
+    def classstrings(s, classindex, offset=0, limit=None):
+        return [v for v, in s._connection.execute(
+                    "SELECT str FROM tokens WHERE class = ? ORDER BY ordinal LIMIT ? OFFSET ?",
+                    (classindex, -1 if limit is None else limit, offset))]
+
+    def strings(s):
+        return (v for v, in s._connection.execute("SELECT str FROM tokens ORDER BY ordinal"))
+
+    def ints(s):
+        return (v for v, in s._connection.execute("SELECT int FROM tokens WHERE int IS NOT NULL"))
+
+    def fingerprint(s):
+        return s._fingerprint
+
+    def close(s):
+        "close the database connection"
+        s._connection.close()
+
+def load(root, path, cacheSize=CACHESIZE, missCacheSize=MISSCACHESIZE):
+    """
+    back root by the token database at path (see module docstring and `Token.usestore`)
+
+    :root:              the root class; must be created with makeroot() and must not have tokens
+    :path:              the path of the database file
+    :cacheSize:         the number of tokens kept alive (see `Token.usestore`)
+    :missCacheSize:     the number of missing values remembered
+    :returns:           the SqliteStore
+    """
+    store = SqliteStore(path, missCacheSize)
+    if store.rootname != root.rootname():
+        store.close()
+        raise RuntimeError("token database is for a different root", store.rootname, root.rootname())
+    root.usestore(store, cacheSize)
+    return store